@@ -1,4 +1,8 @@
 #!/usr/bin/env python
+import contextlib
+import itertools
+
+
 class CoordinatesError(Exception):
     def __init__(self, arg):
         self.msg = arg
@@ -14,6 +18,66 @@ class ReplaceError(Exception):
         self.msg = arg
 
 
+class GridChanges:
+    """
+    Cells changed on a Grid by an operation, or by all the operations of a transaction
+
+    Class Attributes:
+        cells -- dictionary {coordinates: (old element, new element)}, None means void. A cell changed many times
+                 keeps its first old and last new element; cells back to their old element are not reported
+
+    DocTest
+    >>> changes = GridChanges()
+    >>> changes.record((1, 1, 1), None, 'a')
+    >>> changes.record((20, 3, 1), 'b', None)
+    >>> changes.bounding_box(), sorted(changes.chunks(16))
+    (((1, 1, 1), (20, 3, 1)), [(0, 0, 0), (1, 0, 0)])
+    """
+
+    def __init__(self):
+        self.cells = {}
+
+    def __len__(self):
+        return len(self.cells)
+
+    def __iter__(self):
+        return iter(self.cells)
+
+    def items(self):
+        return self.cells.items()
+
+    def record(self, coordinates, old, new):
+        previous = self.cells.get(coordinates)
+        self.cells[coordinates] = (old if previous is None else previous[0], new)
+
+    def update(self, other):
+        """
+        Add the changes of the GridChanges "other", made after the ones already recorded
+        """
+        for coordinates, (old, new) in other.items():
+            self.record(coordinates, old, new)
+
+    def drop_unchanged(self):
+        self.cells = dict((coordinates, change) for coordinates, change in self.cells.items()
+                          if change[0] != change[1])
+
+    def bounding_box(self):
+        """
+        Return (lower, upper) corners of the smallest box holding every changed cell, None if there are none
+        """
+        if not self.cells:
+            return None
+        xs, ys, zs = zip(*self.cells)
+        return (min(xs), min(ys), min(zs)), (max(xs), max(ys), max(zs))
+
+    def chunks(self, chunk_size):
+        """
+        Return the set of the (cx, cy, cz) chunks holding a changed cell. Chunk (0, 0, 0) holds the coordinates from
+        (1, 1, 1) to (chunk_size, chunk_size, chunk_size)
+        """
+        return set(((x - 1) // chunk_size, (y - 1) // chunk_size, (z - 1) // chunk_size) for x, y, z in self.cells)
+
+
 class Grid:
     """
     Description
@@ -73,8 +137,53 @@ class Grid:
     44
     >>> len(Grid.get_neighbours_coordinates((1, 1, 1), 5))
     26
+
+    Regions: g[x, y, z] takes integer coordinates or slices of them (stop excluded, missing axes mean all of them).
+    A single cell gives its element (None if void), a region gives a dictionary of its occupied cells.
+    >>> g = Grid(grid_size=(4, 4, 4))
+    >>> g[1:3, :, 2] = 'a'
+    >>> len(g[:, :, 2]), g[1, 4, 2], g[3, 1, 2]
+    (8, 'a', None)
+    >>> g[1, 2:4, 2] = None
+    >>> sorted(g[1, :, :])
+    [(1, 1, 2), (1, 4, 2)]
+    >>> g.fill_box((1, 1, 4), (4, 4, 4), 'b'), g.clear_box((2, 1, 1), (4, 4, 4))
+    (16, 16)
+    >>> g.copy_box((1, 1, 1), (1, 4, 4), (4, 1, 1)), sorted(g[4, :, :].items())[:2]
+    (6, [((4, 1, 2), 'a'), ((4, 1, 4), 'b')])
+    >>> g.place_mask((2, 2, 1), [[[True], [False, True]], [[1]]], 'c'), sorted(g[2:4, :, :])
+    (3, [(2, 2, 1), (2, 3, 2), (3, 2, 1)])
+    >>> g.fill_box((3, 3, 3), (5, 5, 5), 'c')
+    Traceback (most recent call last):
+    ...
+    CoordinatesError
+
+    Subscriptions: subscribers get the changes of every operation, or of a whole transaction when it ends.
+    Immediate subscribers get the changes of every operation, inside transactions too.
+    >>> g = Grid(grid_size=(4, 4, 4))
+    >>> notified = []
+    >>> g.subscribe(lambda grid, changes: notified.append(sorted(changes.items())))
+    >>> operations = []
+    >>> g.subscribe(lambda grid, changes: operations.append(len(changes)), immediate=True)
+    >>> g.place({(1, 1, 1): 'a'})
+    True
+    >>> with g.transaction():
+    ...     g[:, 1, 1] = 'b'
+    ...     del g[2:, 1, 1]
+    >>> notified, operations
+    ([[((1, 1, 1), (None, 'a'))], [((1, 1, 1), ('a', 'b'))]], [1, 4, 3])
     """
 
+    # Functions called with the exception of every element rejected by place(), for example by instrumentation.
+    # A list (and not a single function) because functions stored as class attributes would become methods.
+    rejection_hooks = []
+
+    # Class defaults: grids nobody subscribed to don't collect changes at all
+    _subscribers = ()
+    _immediate_subscribers = ()
+    _pending_changes = None
+    _transaction_depth = 0
+
     def __init__(self, elements=None, elements_table=None, grid_size=(10, 10, 10), position_overwriting=True):
         # Obtain only positive integer (natural) numbers for the grid size
         max_x = abs(int(tuple(grid_size)[0]))
@@ -126,39 +235,300 @@ class Grid:
                                Default: False
         """
 
-        for coordinates in elements:
-            current_element = elements[coordinates]
-            current_coordinates = coordinates
-            # For debug
-            # print "\n\nCurrent: \t{0}->\t{1}".format(current_coordinates, current_element)
-            try:
-                Grid.ensure_integer_coordinates(current_coordinates)  # if not integers, CoordinatesError will be raised
-                if Grid.is_out_of_bounds(coordinates, self.grid_size):  # avoid out_of_bounds elements
-                    raise CoordinatesError(["Coordinates {0} of the '{1}' element are out of bounds."
-                                            .format(current_coordinates, current_element),
-                                            {current_coordinates: current_element}])
-                elif not Grid.exist(current_element, self.elements_table):  # avoid elements not in
-                    raise ElementsError(["The element '{0}' does not exist in elements_table."
-                                         .format(current_element),
-                                         {current_coordinates: current_element}])
-                elif not self.is_empty and not self.position_overwriting:
-                    raise ReplaceError(["Coordinates {0} are not empty and replacing/overwriting is not permitted"
-                                        .format(current_coordinates),
-                                        {current_coordinates: current_element}])
-                else:  # Aggiungo il valore
-                    self.space.update({current_coordinates: current_element})
-            except (CoordinatesError, ElementsError, ReplaceError) as exc:
+        changes = self._collect_changes()
+        try:
+            for coordinates in elements:
+                current_element = elements[coordinates]
+                current_coordinates = coordinates
                 # For debug
-                # print exc.msg[0]
-                if not ignore_invalid:
-                    #print "Blocking the loop. Remaining elements will be not added."
-                    raise
-                else:
-                    #print "Avoid adding last element at those coordinates. Going on.."
-                    continue
+                # print "\n\nCurrent: \t{0}->\t{1}".format(current_coordinates, current_element)
+                try:
+                    Grid.ensure_integer_coordinates(current_coordinates)  # if not integers, CoordinatesError raised
+                    if Grid.is_out_of_bounds(coordinates, self.grid_size):  # avoid out_of_bounds elements
+                        raise CoordinatesError(["Coordinates {0} of the '{1}' element are out of bounds."
+                                                .format(current_coordinates, current_element),
+                                                {current_coordinates: current_element}])
+                    elif not Grid.exist(current_element, self.elements_table):  # avoid elements not in
+                        raise ElementsError(["The element '{0}' does not exist in elements_table."
+                                             .format(current_element),
+                                             {current_coordinates: current_element}])
+                    elif not self.is_empty and not self.position_overwriting:
+                        raise ReplaceError(["Coordinates {0} are not empty and replacing/overwriting is not permitted"
+                                            .format(current_coordinates),
+                                            {current_coordinates: current_element}])
+                    else:  # Aggiungo il valore
+                        if changes is not None:
+                            changes.record(current_coordinates, self.space.get(current_coordinates), current_element)
+                        self.space.update({current_coordinates: current_element})
+                except (CoordinatesError, ElementsError, ReplaceError) as exc:
+                    # For debug
+                    # print exc.msg[0]
+                    for hook in Grid.rejection_hooks:
+                        hook(exc)
+                    if not ignore_invalid:
+                        #print "Blocking the loop. Remaining elements will be not added."
+                        raise
+                    else:
+                        #print "Avoid adding last element at those coordinates. Going on.."
+                        continue
+        finally:
+            if changes is not None:
+                self._publish_changes(changes)
 
         return True
 
+    # ==== Subscriptions ====
+
+    def subscribe(self, callback, immediate=False):
+        """
+        Call callback(grid, changes) with a GridChanges after every place() or region operation that changed some
+        cell. Inside transaction() the changes are collected and delivered once, when the outermost one ends.
+        Changes made writing self.space directly are not seen.
+        :param immediate: if True, callback is called after every operation, inside transactions too: for indexes
+                          that must follow the space while the transaction is running. Default: False
+        """
+        if immediate:
+            self._immediate_subscribers = list(self._immediate_subscribers) + [callback]
+        else:
+            self._subscribers = list(self._subscribers) + [callback]
+
+    def unsubscribe(self, callback):
+        if callback in self._immediate_subscribers:
+            subscribers = list(self._immediate_subscribers)
+            subscribers.remove(callback)
+            self._immediate_subscribers = subscribers
+        else:
+            subscribers = list(self._subscribers)
+            subscribers.remove(callback)
+            self._subscribers = subscribers
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Context manager batching the changes of many operations in a single notification. Transactions can be
+        nested. Nothing is rolled back on errors: the changes made so far are delivered anyway.
+        """
+        self._transaction_depth += 1
+        try:
+            yield self
+        finally:
+            self._transaction_depth -= 1
+            if not self._transaction_depth and self._pending_changes is not None:
+                changes = self._pending_changes
+                self._pending_changes = None
+                self._deliver_changes(self._subscribers, changes)
+
+    def _collect_changes(self):
+        """
+        Return the GridChanges the current operation has to record its changes in, None if nobody is subscribed
+        """
+        if not (self._subscribers or self._immediate_subscribers):
+            return None
+        return GridChanges()
+
+    def _publish_changes(self, changes):
+        """
+        Deliver the changes of an operation: to the immediate subscribers now, to the others at the end of the
+        transaction if one is running
+        """
+        self._deliver_changes(self._immediate_subscribers, changes)
+        if not self._subscribers:
+            return
+        if self._transaction_depth:
+            if self._pending_changes is None:
+                self._pending_changes = GridChanges()
+            self._pending_changes.update(changes)
+        else:
+            self._deliver_changes(self._subscribers, changes)
+
+    def _deliver_changes(self, subscribers, changes):
+        changes.drop_unchanged()
+        if changes:
+            for callback in list(subscribers):
+                callback(self, changes)
+
+    # ==== Regions ====
+
+    def __getitem__(self, key):
+        ranges, single = self._key_ranges(key)
+        if single:
+            return self.space.get((ranges[0][0], ranges[1][0], ranges[2][0]))
+        space = self.space
+        return dict((coordinates, space[coordinates]) for coordinates in self._occupied_in(ranges))
+
+    def __setitem__(self, key, element):
+        # None empties the region, like a void cell reads None
+        if element is None:
+            self._clear(self._key_ranges(key)[0])
+        else:
+            self._fill(self._key_ranges(key)[0], element)
+
+    def __delitem__(self, key):
+        self._clear(self._key_ranges(key)[0])
+
+    def __contains__(self, coordinates):
+        return tuple(coordinates) in self.space
+
+    def _key_ranges(self, key):
+        """
+        Translate the key of g[key] in one range of coordinates per axis. Return (ranges, True if the key selects a
+        single cell). Slices are clipped to the grid like Python ones; negative indices don't count from the end.
+        """
+        if not isinstance(key, tuple):
+            key = (key,)
+        if len(key) > 3:
+            raise CoordinatesError(["Grid has 3 axes, {0} indices were given.".format(len(key)), key])
+        key = key + (slice(None),) * (3 - len(key))
+        ranges = []
+        for axis, index in enumerate(key):
+            limit = self.grid_size[axis]
+            if isinstance(index, slice):
+                start = 1 if index.start is None else index.start
+                stop = limit + 1 if index.stop is None else min(index.stop, limit + 1)
+                step = 1 if index.step is None else index.step
+                if step < 1:
+                    raise CoordinatesError(["Grid slices need a positive step, not {0}.".format(step), key])
+                if start < 1:  # first coordinate of the slice inside the grid
+                    start += (step - start) // step * step
+                ranges.append(range(start, stop, step))
+            elif isinstance(index, int):
+                if not 0 < index <= limit:
+                    raise CoordinatesError(["Coordinates {0} are out of bounds.".format(key), key])
+                ranges.append(range(index, index + 1))
+            else:
+                raise CoordinatesError(["Coordinates {0} MUST be integer numbers or slices.".format(key), key])
+        return ranges, not any(isinstance(index, slice) for index in key)
+
+    def _box_ranges(self, lower, upper):
+        """
+        Check once the box going from "lower" to "upper" coordinates (both included) and return its range of
+        coordinates per axis
+        """
+        Grid.ensure_integer_coordinates(lower)
+        Grid.ensure_integer_coordinates(upper)
+        if Grid.is_out_of_bounds([lower, upper], self.grid_size):
+            raise CoordinatesError(["Box from {0} to {1} is out of bounds.".format(lower, upper), (lower, upper)])
+        if lower[0] > upper[0] or lower[1] > upper[1] or lower[2] > upper[2]:
+            raise CoordinatesError(["Box from {0} to {1} has the lower corner above the upper one."
+                                    .format(lower, upper), (lower, upper)])
+        return [range(lower[axis], upper[axis] + 1) for axis in range(3)]
+
+    def _occupied_in(self, ranges):
+        """
+        Return the occupied coordinates among the ones of "ranges" (one range per axis) looking at the cells of the
+        region or at the occupied cells of the space, whichever are fewer
+        """
+        space = self.space
+        if len(ranges[0]) * len(ranges[1]) * len(ranges[2]) <= len(space):
+            return [coordinates for coordinates in itertools.product(*ranges) if coordinates in space]
+        xs, ys, zs = [frozenset(axis_range) for axis_range in ranges]
+        return [coordinates for coordinates in space
+                if coordinates[0] in xs and coordinates[1] in ys and coordinates[2] in zs]
+
+    def _check_element(self, element):
+        if not Grid.exist(element, self.elements_table):
+            raise ElementsError(["The element '{0}' does not exist in elements_table.".format(element), element])
+
+    def _check_overwriting(self, coordinates_list):
+        if not self.position_overwriting:
+            for coordinates in coordinates_list:
+                if coordinates in self.space:
+                    raise ReplaceError(["Coordinates {0} are not empty and replacing/overwriting is not permitted"
+                                        .format(coordinates), {coordinates: self.space[coordinates]}])
+
+    def _write_cells(self, updates=None, removals=()):
+        """
+        Empty the "removals" coordinates and store the "updates" dictionary {coordinates: element}, both already
+        checked. Every region operation writes through here.
+        """
+        changes = self._collect_changes()
+        space = self.space
+        if changes is not None:
+            before = dict((coordinates, space.get(coordinates)) for coordinates in removals)
+            if updates:
+                before.update((coordinates, space.get(coordinates)) for coordinates in updates)
+        try:
+            for coordinates in removals:
+                space.pop(coordinates, None)
+            if updates:
+                space.update(updates)
+        finally:
+            # also after a partial write: what really changed is reported
+            if changes is not None:
+                for coordinates, old in before.items():
+                    changes.record(coordinates, old, space.get(coordinates))
+                self._publish_changes(changes)
+
+    def _fill(self, ranges, element):
+        self._check_element(element)
+        self._check_overwriting(self._occupied_in(ranges))
+        cells = dict.fromkeys(itertools.product(*ranges), element)
+        self._write_cells(cells)
+        return len(cells)
+
+    def _clear(self, ranges):
+        removals = self._occupied_in(ranges)
+        self._write_cells(removals=removals)
+        return len(removals)
+
+    def fill_box(self, lower, upper, element):
+        """
+        Place "element" in every cell of the box going from "lower" to "upper" coordinates (both included).
+        Box, element and overwriting are checked once for the whole box: on error nothing is placed.
+        :return: the number of cells filled
+        """
+        return self._fill(self._box_ranges(lower, upper), element)
+
+    def clear_box(self, lower, upper):
+        """
+        Empty every cell of the box going from "lower" to "upper" coordinates (both included)
+        :return: the number of elements removed
+        """
+        return self._clear(self._box_ranges(lower, upper))
+
+    def copy_box(self, lower, upper, destination, source=None):
+        """
+        Copy the box going from "lower" to "upper" coordinates (both included) of the "source" Grid (default: this
+        one) in the box of the same size whose lower corner is "destination". The destination box becomes equal to
+        the source one: its cells void in the source are emptied. Source and destination may overlap.
+        :return: the number of elements copied
+        """
+        if source is None:
+            source = self
+        ranges = source._box_ranges(lower, upper)
+        offset = [destination[axis] - lower[axis] for axis in range(3)]
+        target = self._box_ranges(destination, tuple(upper[axis] + offset[axis] for axis in range(3)))
+        dx, dy, dz = offset
+        cells = dict(((x + dx, y + dy, z + dz), source.space[(x, y, z)]) for (x, y, z) in source._occupied_in(ranges))
+        if source is not self and self.elements_table is not None:
+            for element in set(cells.values()):
+                self._check_element(element)
+        occupied = self._occupied_in(target)
+        self._check_overwriting(occupied)
+        self._write_cells(cells, [coordinates for coordinates in occupied if coordinates not in cells])
+        return len(cells)
+
+    def place_mask(self, lower, mask, element):
+        """
+        Place "element" where the mask is true. mask[i][j][k] is the cell lower + (i, j, k): a 3d numpy array or
+        nested sequences (rows may have different lengths). The true cells are checked once, as a box.
+        :return: the number of cells filled
+        """
+        if hasattr(mask, "nonzero") and hasattr(mask, "shape"):  # numpy: the true cells are found at C speed
+            offsets = list(zip(*[axis.tolist() for axis in mask.nonzero()]))
+        else:
+            offsets = [(i, j, k) for i, plane in enumerate(mask) for j, row in enumerate(plane)
+                       for k, value in enumerate(row) if value]
+        if not offsets:
+            return 0
+        self._check_element(element)
+        x, y, z = lower
+        self._box_ranges(lower, tuple(lower[axis] + max(offset[axis] for offset in offsets) for axis in range(3)))
+        cells = dict.fromkeys([(x + i, y + j, z + k) for i, j, k in offsets], element)
+        self._check_overwriting(cells)
+        self._write_cells(cells)
+        return len(cells)
+
     @staticmethod
     def ensure_integer_coordinates(coordinates):
         """
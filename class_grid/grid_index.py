@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+"""
+    File name: grid_index.py
+    Python Version: 2.7.X
+    Spatial index of Grid elements for k-nearest and radius queries.
+    Cells are kept in cubic buckets (a uniform grid of "bucket_size" side), separately for every element type.
+    Nearest queries visit buckets ring by ring around the query and stop as soon as no farther bucket can hold a
+    closer cell; when the rings would visit more buckets than the ones actually holding cells (sparse grids), the
+    non empty buckets are visited sorted by their distance instead. Either way the work depends on the cells near the
+    answer, not on the distance of the answer.
+
+    Metrics: "euclidean", "manhattan", "chebyshev" (the neighbours cube of get_neighbours_coordinates()).
+
+    Usage
+        g = IndexedGrid({(1, 1, 1): 'a', (7, 3, 9): 'b'}, grid_size=(100, 100, 100))
+        g.nearest((5, 5, 5), k=3, element='a')           # [(distance, coordinates, element), ...]
+        g.within((5, 5, 5), 10, metric="manhattan")
+"""
+import heapq
+import math
+
+from grid import Grid
+
+
+def _euclidean(dx, dy, dz):
+    return math.sqrt(dx * dx + dy * dy + dz * dz)
+
+
+def _manhattan(dx, dy, dz):
+    return dx + dy + dz
+
+
+def _chebyshev(dx, dy, dz):
+    return max(dx, dy, dz)
+
+
+# Distance functions of the absolute coordinate differences
+METRICS = {"euclidean": _euclidean, "manhattan": _manhattan, "chebyshev": _chebyshev}
+
+
+def _metric(name):
+    try:
+        return METRICS[name]
+    except KeyError:
+        raise ValueError("metric must be one of {0}, not {1}".format(sorted(METRICS), name))
+
+
+class SpatialIndex:
+    """
+    Bucketed uniform grid of coordinates, one per element type
+
+    Class Attributes:
+        bucket_size -- side of the cubic buckets (default: 8)
+
+    DocTest
+    >>> index = SpatialIndex(bucket_size=4)
+    >>> index.rebuild({(1, 1, 1): 'a', (3, 3, 3): 'a', (20, 20, 20): 'a', (2, 2, 2): 'b'})
+    >>> index.nearest((1, 1, 2), k=2, element='a')
+    [(1.0, (1, 1, 1), 'a'), (3.0, (3, 3, 3), 'a')]
+    >>> index.nearest((19, 19, 19), metric="chebyshev")
+    [(1, (20, 20, 20), 'a')]
+    >>> index.within((2, 2, 2), 3, metric="manhattan")
+    [(0, (2, 2, 2), 'b'), (3, (1, 1, 1), 'a'), (3, (3, 3, 3), 'a')]
+    >>> index.remove((20, 20, 20), 'a')
+    >>> index.nearest((19, 19, 19), element='a')[0][1]
+    (3, 3, 3)
+    >>> len(index), index.nearest((1, 1, 1), element='z')
+    (3, [])
+    """
+
+    def __init__(self, bucket_size=8):
+        self.bucket_size = int(bucket_size)
+        self._buckets = {}  # element -> {bucket key: set of coordinates}
+        self._length = 0
+
+    def __len__(self):
+        return self._length
+
+    def _bucket_key(self, coordinates):
+        b = self.bucket_size
+        return (coordinates[0] - 1) // b, (coordinates[1] - 1) // b, (coordinates[2] - 1) // b
+
+    def add(self, coordinates, element):
+        buckets = self._buckets.get(element)
+        if buckets is None:
+            buckets = self._buckets[element] = {}
+        key = self._bucket_key(coordinates)
+        cells = buckets.get(key)
+        if cells is None:
+            cells = buckets[key] = set()
+        if coordinates not in cells:
+            cells.add(coordinates)
+            self._length += 1
+
+    def remove(self, coordinates, element):
+        buckets = self._buckets.get(element)
+        if buckets is None:
+            return
+        key = self._bucket_key(coordinates)
+        cells = buckets.get(key)
+        if cells is not None and coordinates in cells:
+            cells.remove(coordinates)
+            self._length -= 1
+            if not cells:
+                del buckets[key]
+                if not buckets:
+                    del self._buckets[element]
+
+    def rebuild(self, space):
+        """
+        Index from scratch the {coordinates: element} dictionary "space"
+        """
+        self._buckets = {}
+        self._length = 0
+        for coordinates, element in space.items():
+            self.add(coordinates, element)
+
+    def _bucket_gap(self, key, coordinates):
+        """
+        Return the per axis distance from "coordinates" to the closest cell of bucket "key"
+        """
+        b = self.bucket_size
+        gaps = []
+        for axis in range(3):
+            low = key[axis] * b + 1
+            high = low + b - 1
+            value = coordinates[axis]
+            gaps.append(low - value if value < low else (value - high if value > high else 0))
+        return gaps
+
+    def _selected(self, element):
+        if element is None:
+            return list(self._buckets.items())
+        buckets = self._buckets.get(element)
+        return [(element, buckets)] if buckets is not None else []
+
+    def nearest(self, coordinates, k=1, element=None, metric="euclidean", max_distance=None):
+        """
+        Return the "k" cells closest to "coordinates" as a list of (distance, coordinates, element) sorted by
+        distance. Cells at the same distance are ordered by coordinates.
+            element -- only cells holding this element. None means any element (default: None)
+            metric -- "euclidean", "manhattan" or "chebyshev" (default: "euclidean")
+            max_distance -- ignore cells farther than this
+        """
+        distance = _metric(metric)
+        x, y, z = coordinates
+        qx, qy, qz = self._bucket_key(coordinates)
+        best = []  # max heap of the k best: (-distance, negated coordinates, coordinates, element)
+
+        def consider(key, buckets, element_type):
+            for cx, cy, cz in buckets.get(key, ()):
+                d = distance(abs(cx - x), abs(cy - y), abs(cz - z))
+                if max_distance is not None and d > max_distance:
+                    continue
+                entry = (-d, (-cx, -cy, -cz), (cx, cy, cz), element_type)
+                if len(best) < k:
+                    heapq.heappush(best, entry)
+                elif entry > best[0]:
+                    heapq.heapreplace(best, entry)
+
+        for element_type, buckets in self._selected(element):
+            occupied = len(buckets)
+            ring = 0
+            done = False
+            # Ring by ring while a ring costs less than visiting all the occupied buckets
+            while (2 * ring + 1) ** 3 <= occupied:
+                for bx in range(qx - ring, qx + ring + 1):
+                    for by in range(qy - ring, qy + ring + 1):
+                        if abs(bx - qx) == ring or abs(by - qy) == ring:
+                            z_range = range(qz - ring, qz + ring + 1)
+                        else:
+                            z_range = (qz - ring, qz + ring) if ring else (qz,)
+                        for bz in z_range:
+                            consider((bx, by, bz), buckets, element_type)
+                # Any cell of the next ring is at least ring * bucket_size + 1 away on some axis: stop only when the
+                # k-th best is closer, the next ring could hold cells tied with it that come first by coordinates
+                if len(best) == k and -best[0][0] < ring * self.bucket_size + 1:
+                    done = True
+                    break
+                ring += 1
+            if done:
+                continue
+            # Sparse: the remaining occupied buckets sorted by the distance of their closest cell
+            candidates = []
+            for key in buckets:
+                if max(abs(key[0] - qx), abs(key[1] - qy), abs(key[2] - qz)) >= ring:
+                    candidates.append((distance(*self._bucket_gap(key, coordinates)), key))
+            candidates.sort()
+            for bound, key in candidates:
+                if (len(best) == k and bound > -best[0][0]) or (max_distance is not None and bound > max_distance):
+                    break
+                consider(key, buckets, element_type)
+
+        return [(-entry[0], entry[2], entry[3]) for entry in sorted(best, reverse=True)]
+
+    def within(self, coordinates, radius, element=None, metric="euclidean"):
+        """
+        Return every cell at distance <= "radius" from "coordinates" as a list of (distance, coordinates, element)
+        sorted by distance and coordinates.
+            element -- only cells holding this element. None means any element (default: None)
+            metric -- "euclidean", "manhattan" or "chebyshev" (default: "euclidean")
+        """
+        distance = _metric(metric)
+        x, y, z = coordinates
+        reach = int(math.floor(radius))
+        low = self._bucket_key((x - reach, y - reach, z - reach))
+        high = self._bucket_key((x + reach, y + reach, z + reach))
+        box_buckets = (high[0] - low[0] + 1) * (high[1] - low[1] + 1) * (high[2] - low[2] + 1)
+        found = []
+        for element_type, buckets in self._selected(element):
+            if box_buckets <= len(buckets):
+                keys = [(bx, by, bz) for bx in range(low[0], high[0] + 1) for by in range(low[1], high[1] + 1)
+                        for bz in range(low[2], high[2] + 1)]
+            else:  # fewer occupied buckets than buckets in the box: filter the occupied ones
+                keys = [key for key in buckets if distance(*self._bucket_gap(key, coordinates)) <= radius]
+            for key in keys:
+                for cx, cy, cz in buckets.get(key, ()):
+                    d = distance(abs(cx - x), abs(cy - y), abs(cz - z))
+                    if d <= radius:
+                        found.append((d, (cx, cy, cz), element_type))
+        found.sort(key=lambda item: (item[0], item[1]))
+        return found
+
+
+class IndexedGrid(Grid):
+    """
+    Grid keeping a SpatialIndex of its elements up to date through its change notifications. The index follows
+    every operation, inside a transaction() too: only the other subscribers get the changes when it ends.
+
+    DocTest
+    >>> g = IndexedGrid({(1, 1, 1): 'a', (9, 9, 9): 'b'}, bucket_size=2)
+    >>> g.nearest((8, 8, 8), element='a', metric="manhattan")
+    [(21, (1, 1, 1), 'a')]
+    >>> g.place({(7, 7, 7): 'a', (9, 9, 9): 'a', (0, 1, 1): 'a'})
+    True
+    >>> [(coordinates, element) for d, coordinates, element in g.nearest((8, 8, 8), k=3)]
+    [((7, 7, 7), 'a'), ((9, 9, 9), 'a'), ((1, 1, 1), 'a')]
+    >>> len(g.within((8, 8, 8), 2, element='b'))
+    0
+    >>> g[1:9, 1:9, 1:9] = None
+    >>> g.fill_box((3, 3, 3), (4, 4, 4), 'b')
+    8
+    >>> g.nearest((1, 1, 1), k=2)
+    [(3.4641016151377544, (3, 3, 3), 'b'), (4.123105625617661, (3, 3, 4), 'b')]
+    >>> with g.transaction():
+    ...     g.clear_box((3, 3, 3), (3, 4, 4))
+    ...     len(g.index)
+    4
+    5
+    >>> len(g.index)
+    5
+    """
+
+    def __init__(self, elements=None, elements_table=None, grid_size=(10, 10, 10), position_overwriting=True,
+                 bucket_size=8):
+        Grid.__init__(self, elements, elements_table, grid_size, position_overwriting)
+        self.index = SpatialIndex(bucket_size)
+        self.index.rebuild(self.space)
+        self.subscribe(self._follow, immediate=True)
+
+    def _follow(self, grid, changes):
+        for coordinates, (old, new) in changes.items():
+            if old is not None:
+                self.index.remove(coordinates, old)
+            if new is not None:
+                self.index.add(coordinates, new)
+
+    def nearest(self, coordinates, k=1, element=None, metric="euclidean", max_distance=None):
+        """
+        See SpatialIndex.nearest()
+        """
+        return self.index.nearest(coordinates, k, element, metric, max_distance)
+
+    def within(self, coordinates, radius, element=None, metric="euclidean"):
+        """
+        See SpatialIndex.within()
+        """
+        return self.index.within(coordinates, radius, element, metric)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,383 @@
+#!/usr/bin/env python
+"""
+    File name: grid_regions.py
+    Python Version: 2.7.X
+    Region algorithms on Grid: connected component labelling, flood fill and shortest paths (BFS and A*).
+    Cells are handled as flat integer indices of a grid padded with one void layer on every side, so the neighbours of
+    a cell are just the index plus precomputed offsets: no tuples are built and no bounds are checked while visiting.
+    Labelling uses a union-find over the occupied cells only, so its cost is proportional to the number of elements,
+    not to the grid volume.
+
+    Connectivity:
+        6  -- cells sharing a face
+        18 -- cells sharing a face or an edge
+        26 -- cells sharing a face, an edge or a corner (the 3x3 cube of get_neighbours_coordinates())
+"""
+import heapq
+from collections import deque
+
+from grid import Grid, CoordinatesError
+
+
+def _offsets(connectivity):
+    offsets = []
+    for dz in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            for dx in (-1, 0, 1):
+                moved_axes = abs(dx) + abs(dy) + abs(dz)
+                if moved_axes == 0:
+                    continue
+                if (connectivity == 6 and moved_axes > 1) or (connectivity == 18 and moved_axes > 2):
+                    continue
+                offsets.append((dx, dy, dz))
+    return tuple(offsets)
+
+
+# (dx, dy, dz) of the neighbours of a cell for every connectivity
+NEIGHBOUR_OFFSETS = dict((connectivity, _offsets(connectivity)) for connectivity in (6, 18, 26))
+
+
+class FlatSpace:
+    """
+    Flat integer indexing of a grid padded with one void layer on every side.
+    Index of (x, y, z) is x + y * px + z * px * py where px and py are the padded x and y sizes: moving to a neighbour
+    is adding a constant offset and a neighbour of a border cell lands in the padding, never in another row.
+
+    DocTest
+    >>> fs = FlatSpace((3, 4, 5))
+    >>> fs.coordinates(fs.index((3, 2, 5)))
+    (3, 2, 5)
+    >>> len(fs.deltas(26)), len(fs.deltas(18)), len(fs.deltas(6))
+    (26, 18, 6)
+    >>> fs.index((2, 1, 1)) + fs.deltas(6)[0] == fs.index((2, 1, 0))
+    True
+    """
+
+    def __init__(self, grid_size):
+        self.grid_size = tuple(grid_size)
+        self.px = self.grid_size[0] + 2
+        self.py = self.grid_size[1] + 2
+        self.pz = self.grid_size[2] + 2
+        self.plane = self.px * self.py
+        self.volume = self.plane * self.pz
+
+    def index(self, coordinates):
+        return coordinates[0] + coordinates[1] * self.px + coordinates[2] * self.plane
+
+    def coordinates(self, index):
+        z, rest = divmod(index, self.plane)
+        y, x = divmod(rest, self.px)
+        return x, y, z
+
+    def deltas(self, connectivity):
+        try:
+            offsets = NEIGHBOUR_OFFSETS[connectivity]
+        except KeyError:
+            raise ValueError("connectivity must be 6, 18 or 26, not {0}".format(connectivity))
+        return tuple(dx + dy * self.px + dz * self.plane for dx, dy, dz in offsets)
+
+    def walls(self):
+        """
+        Return a bytearray as long as the padded volume with 1 on the padding cells and 0 inside the grid
+        """
+        walls = bytearray(self.volume)
+        plane_wall = b"\x01" * self.plane
+        row_wall = b"\x01" * self.px
+        walls[0:self.plane] = plane_wall
+        walls[self.volume - self.plane:self.volume] = plane_wall
+        for z in range(1, self.pz - 1):
+            base = z * self.plane
+            walls[base:base + self.px] = row_wall
+            walls[base + self.plane - self.px:base + self.plane] = row_wall
+            for y in range(1, self.py - 1):
+                row = base + y * self.px
+                walls[row] = 1
+                walls[row + self.px - 1] = 1
+        return walls
+
+
+def _grid_coordinates(grid, coordinates):
+    """
+    Return "coordinates" as a tuple, raising CoordinatesError if they are not integers inside "grid": a flat index out
+    of the grid would land in the padding or wrap around to another cell
+    """
+    coordinates = tuple(coordinates)
+    if len(coordinates) != 3:
+        raise CoordinatesError(["Coordinates {0} MUST be a (x, y, z) tuple.".format(coordinates), coordinates])
+    Grid.ensure_integer_coordinates(coordinates)
+    if Grid.is_out_of_bounds(coordinates, grid.grid_size):
+        raise CoordinatesError(["Coordinates {0} are out of bounds.".format(coordinates), coordinates])
+    return coordinates
+
+
+def flat_cells(grid, flat_space=None):
+    """
+    Return a dictionary {flat index: element} of the cells of "grid"
+    """
+    if flat_space is None:
+        flat_space = FlatSpace(grid.grid_size)
+    px = flat_space.px
+    plane = flat_space.plane
+    return dict((x + y * px + z * plane, element) for (x, y, z), element in grid.space.items())
+
+
+def label_components(grid, connectivity=26, elements=None):
+    """
+    Label the clusters of connected cells holding the same element.
+    Return a tuple (labels, sizes): a dictionary {coordinates: label} and a dictionary {label: number of cells}.
+    Labels are consecutive integers starting from 1, in x, y, z scan order of the first cell of every cluster.
+        connectivity -- 6, 18 or 26 (default: 26)
+        elements -- if given, only the cells holding one of these elements are labelled
+
+    DocTest
+    >>> from grid import Grid
+    >>> g = Grid({(1, 1, 1): 'a', (2, 2, 2): 'a', (3, 3, 3): 'b', (5, 5, 5): 'a', (5, 5, 4): 'a'})
+    >>> labels, sizes = label_components(g)
+    >>> labels[(1, 1, 1)] == labels[(2, 2, 2)], labels[(5, 5, 5)] == labels[(5, 5, 4)], sorted(sizes.values())
+    (True, True, [1, 2, 2])
+    >>> len(label_components(g, 6)[1])
+    4
+    >>> len(label_components(g, 26, ['a'])[1])
+    2
+    """
+    fs = FlatSpace(grid.grid_size)
+    cells = flat_cells(grid, fs)
+    if elements is not None:
+        elements = set(elements)
+        cells = dict((index, element) for index, element in cells.items() if element in elements)
+    by_element = {}
+    for index, element in cells.items():
+        indices = by_element.get(element)
+        if indices is None:
+            indices = by_element[element] = set()
+        indices.add(index)
+
+    parent = {}  # union-find forest of the cells having at least one neighbour, the others are roots of themselves
+
+    def find(index):
+        while parent.get(index, index) != index:  # path halving
+            grand_parent = parent.get(parent[index], parent[index])
+            parent[index] = grand_parent
+            index = grand_parent
+        return index
+
+    # Only the neighbours coming before in scan order: every pair of cells is checked once. Pairs of cells are found
+    # with set intersections, so the loop below runs only for cells really touching each other.
+    backward = [delta for delta in fs.deltas(connectivity) if delta < 0]
+    for indices in by_element.values():
+        for delta in backward:
+            for neighbour in indices.intersection(map(delta.__add__, indices)):
+                root = find(neighbour - delta)
+                other = find(neighbour)
+                if other != root:
+                    # the root with the lowest index wins: labels follow scan order
+                    if other < root:
+                        parent[root] = other
+                    else:
+                        parent[other] = root
+
+    labels = {}
+    sizes = {}
+    root_labels = {}
+    for index in sorted(cells):
+        root = find(index) if index in parent else index
+        label = root_labels.get(root)
+        if label is None:
+            label = root_labels[root] = len(root_labels) + 1
+            sizes[label] = 0
+        sizes[label] += 1
+        labels[fs.coordinates(index)] = label
+    return labels, sizes
+
+
+def flood_fill(grid, seed, connectivity=6, new_element=None):
+    """
+    Return the set of coordinates connected to "seed" holding the same content of it: the same element, or void if
+    "seed" is empty. If "new_element" is given the region is filled with it through Grid.place().
+        connectivity -- 6, 18 or 26 (default: 6)
+
+    DocTest
+    >>> from grid import Grid
+    >>> g = Grid({(1, 1, 1): 'a', (2, 1, 1): 'a', (3, 1, 1): 'b', (1, 2, 1): 'a'}, grid_size=(3, 2, 1))
+    >>> sorted(flood_fill(g, (1, 1, 1)))
+    [(1, 1, 1), (1, 2, 1), (2, 1, 1)]
+    >>> sorted(flood_fill(g, (3, 2, 1), new_element='c'))
+    [(2, 2, 1), (3, 2, 1)]
+    >>> g.space[(2, 2, 1)]
+    'c'
+    >>> flood_fill(g, (0, 1, 1))
+    Traceback (most recent call last):
+    ...
+    CoordinatesError
+    """
+    seed = _grid_coordinates(grid, seed)
+    fs = FlatSpace(grid.grid_size)
+    deltas = fs.deltas(connectivity)
+    start = fs.index(seed)
+    target = grid.space.get(seed)
+    if target is None:
+        # void region: the padding and every element stop the fill
+        visited = fs.walls()
+        px = fs.px
+        plane = fs.plane
+        for (x, y, z) in grid.space:
+            visited[x + y * px + z * plane] = 1
+        visited[start] = 1
+        queue = deque([start])
+        region = [start]
+        while queue:
+            index = queue.popleft()
+            for delta in deltas:
+                neighbour = index + delta
+                if not visited[neighbour]:
+                    visited[neighbour] = 1
+                    queue.append(neighbour)
+                    region.append(neighbour)
+    else:
+        cells = flat_cells(grid, fs)
+        visited = set([start])
+        queue = deque([start])
+        while queue:
+            index = queue.popleft()
+            for delta in deltas:
+                neighbour = index + delta
+                if neighbour not in visited and cells.get(neighbour, visited) == target:
+                    visited.add(neighbour)
+                    queue.append(neighbour)
+        region = visited
+
+    region = set(fs.coordinates(index) for index in region)
+    if new_element is not None:
+        grid.place(dict((coordinates, new_element) for coordinates in region))
+    return region
+
+
+def _passability(grid, fs, passable, start, goal):
+    """
+    Return a bytearray with 1 on the cells a path can't cross (padding and elements not in "passable")
+    """
+    blocked = fs.walls()
+    passable = set(passable) if passable is not None else set()
+    px = fs.px
+    plane = fs.plane
+    for (x, y, z), element in grid.space.items():
+        if element not in passable:
+            blocked[x + y * px + z * plane] = 1
+    blocked[fs.index(start)] = 0
+    blocked[fs.index(goal)] = 0
+    return blocked
+
+
+def _rebuild_path(fs, came_from, goal):
+    path = []
+    index = goal
+    while index is not None:
+        path.append(fs.coordinates(index))
+        index = came_from[index]
+    path.reverse()
+    return path
+
+
+def shortest_path(grid, start, goal, connectivity=6, passable=None):
+    """
+    Breadth first search of the shortest path from "start" to "goal" moving between neighbour cells.
+    Return the list of coordinates from start to goal (both included) or None if goal can't be reached.
+        connectivity -- 6, 18 or 26 (default: 6)
+        passable -- elements a path can cross. Void cells are always passable; start and goal may hold anything
+
+    DocTest
+    >>> from grid import Grid
+    >>> wall = dict(((2, y, 1), 'w') for y in range(1, 3))
+    >>> g = Grid(wall, grid_size=(3, 3, 1))
+    >>> shortest_path(g, (1, 1, 1), (3, 1, 1))
+    [(1, 1, 1), (1, 2, 1), (1, 3, 1), (2, 3, 1), (3, 3, 1), (3, 2, 1), (3, 1, 1)]
+    >>> len(shortest_path(g, (1, 1, 1), (3, 1, 1), passable=['w']))
+    3
+    >>> shortest_path(Grid(dict(((2, y, 1), 'w') for y in range(1, 4)), grid_size=(3, 3, 1)), (1, 1, 1), (3, 1, 1))
+    >>> shortest_path(g, (1, 1, 1), (4, 1, 1))
+    Traceback (most recent call last):
+    ...
+    CoordinatesError
+    """
+    start = _grid_coordinates(grid, start)
+    goal = _grid_coordinates(grid, goal)
+    fs = FlatSpace(grid.grid_size)
+    deltas = fs.deltas(connectivity)
+    blocked = _passability(grid, fs, passable, start, goal)
+    source = fs.index(start)
+    target = fs.index(goal)
+    came_from = {source: None}
+    blocked[source] = 1
+    queue = deque([source])
+    while queue:
+        index = queue.popleft()
+        if index == target:
+            return _rebuild_path(fs, came_from, target)
+        for delta in deltas:
+            neighbour = index + delta
+            if not blocked[neighbour]:
+                blocked[neighbour] = 1
+                came_from[neighbour] = index
+                queue.append(neighbour)
+    return None
+
+
+def astar_path(grid, start, goal, connectivity=6, passable=None):
+    """
+    A* search of the shortest path from "start" to "goal": same result length of shortest_path() visiting far less
+    cells when the goal is not hidden behind obstacles. Same arguments and return value of shortest_path().
+
+    DocTest
+    >>> from grid import Grid
+    >>> g = Grid(dict(((2, y, 1), 'w') for y in range(1, 3)), grid_size=(3, 3, 1))
+    >>> len(astar_path(g, (1, 1, 1), (3, 1, 1))) == len(shortest_path(g, (1, 1, 1), (3, 1, 1)))
+    True
+    >>> len(astar_path(Grid(grid_size=(20, 20, 20)), (1, 1, 1), (20, 20, 20), 26))
+    20
+    """
+    start = _grid_coordinates(grid, start)
+    goal = _grid_coordinates(grid, goal)
+    fs = FlatSpace(grid.grid_size)
+    deltas = fs.deltas(connectivity)
+    blocked = _passability(grid, fs, passable, start, goal)
+    gx, gy, gz = goal
+
+    # Admissible heuristics: the fewest moves needed without obstacles
+    if connectivity == 6:
+        def heuristic(index):
+            x, y, z = fs.coordinates(index)
+            return abs(x - gx) + abs(y - gy) + abs(z - gz)
+    elif connectivity == 18:
+        def heuristic(index):
+            x, y, z = fs.coordinates(index)
+            dx, dy, dz = abs(x - gx), abs(y - gy), abs(z - gz)
+            return max(dx, dy, dz, (dx + dy + dz + 1) // 2)
+    else:
+        def heuristic(index):
+            x, y, z = fs.coordinates(index)
+            return max(abs(x - gx), abs(y - gy), abs(z - gz))
+
+    source = fs.index(start)
+    target = fs.index(goal)
+    came_from = {source: None}
+    cost = {source: 0}
+    frontier = [(heuristic(source), 0, source)]
+    while frontier:
+        estimate, moves, index = heapq.heappop(frontier)
+        if index == target:
+            return _rebuild_path(fs, came_from, target)
+        if moves > cost[index]:
+            continue  # stale queue entry: a shorter way to this cell was found later
+        moves += 1
+        for delta in deltas:
+            neighbour = index + delta
+            if not blocked[neighbour] and moves < cost.get(neighbour, moves + 1):
+                cost[neighbour] = moves
+                came_from[neighbour] = index
+                heapq.heappush(frontier, (moves + heuristic(neighbour), moves, neighbour))
+    return None
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
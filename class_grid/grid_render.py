@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+"""
+    File name: grid_render.py
+    Python Version: 2.7.X
+    Requirements: numpy, matplotlib
+    Render a Grid in 3d to an image file with the non interactive (Agg) matplotlib backend.
+    All the cells are drawn with one single scatter call, instead of one plot call per cell.
+    Over "cell_budget" cells the grid is downsampled: cells are aggregated in cubic blocks and every block is drawn
+    as one marker, with the color of its most common element and a size proportional to how many cells it contains.
+
+    Usage
+        from grid_render import render_grid
+        render_grid(g, "grid.png")
+        render_grid(g, "grid.png", cell_budget=5000, colors={'a': 'red', 'b': 'blue'})
+"""
+import math
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError("grid_render requires numpy: pip install numpy matplotlib")
+
+
+def grid_arrays(grid):
+    """
+    Return a dictionary {element: numpy array of shape (n, 3)} with the coordinates of every element type in the grid
+    """
+    _require_numpy()
+    flat = {}
+    for coordinates, element in grid.space.items():
+        coordinates_list = flat.get(element)
+        if coordinates_list is None:
+            coordinates_list = flat[element] = []
+        coordinates_list.extend(coordinates)
+    return dict((element, np.array(coordinates_list, dtype=np.int64).reshape(-1, 3))
+                for element, coordinates_list in flat.items())
+
+
+def _block_keys(points, block):
+    """
+    Return the block of every point as a single integer (blocks of "block" side, 0 based)
+    """
+    blocks = (points - 1) // block
+    side = int(blocks.max()) + 1
+    return (blocks[:, 2] * side + blocks[:, 1]) * side + blocks[:, 0], side
+
+
+def downsample_elements(arrays, block):
+    """
+    Aggregate the coordinates of every element type of "arrays" (see grid_arrays()) in the same cubic blocks of
+    "block" side.
+    Return a tuple (elements, centers, counts, majority): the sorted element types, the center of every block
+    containing at least one cell (numpy array of shape (m, 3)), how many cells of any element every block contains
+    and the position in "elements" of the most common element of every block.
+    """
+    _require_numpy()
+    elements = sorted(arrays, key=str)
+    points = np.concatenate([arrays[element] for element in elements]) if elements else np.empty((0, 3), np.int64)
+    owners = np.repeat(np.arange(len(elements)), [len(arrays[element]) for element in elements])
+    if len(points) == 0:
+        return elements, points.astype(np.float64), np.zeros(0, dtype=np.int64), owners
+    keys, side = _block_keys(points, max(block, 1))
+    keys, inverse = np.unique(keys, return_inverse=True)
+    per_element = np.bincount(inverse * len(elements) + owners,
+                              minlength=len(keys) * len(elements)).reshape(len(keys), len(elements))
+    blocks = np.empty((len(keys), 3), dtype=np.int64)
+    blocks[:, 0] = keys % side
+    blocks[:, 1] = (keys // side) % side
+    blocks[:, 2] = keys // (side * side)
+    centers = blocks * block + 1 + (block - 1) / 2.0
+    return elements, centers, per_element.sum(axis=1), per_element.argmax(axis=1)
+
+
+def choose_block(arrays, cell_budget):
+    """
+    Return the smallest block side that brings the number of markers of "arrays" (see grid_arrays()) under
+    "cell_budget"
+    """
+    _require_numpy()
+    if cell_budget < 1:  # a grid with cells has at least one block: no side would do
+        raise ValueError("cell_budget must be at least 1, not {0}".format(cell_budget))
+    total = sum(len(points) for points in arrays.values())
+    if total <= cell_budget:
+        return 1
+    # Start from the block side a completely full grid would need, then grow while there are too many markers
+    block = max(2, int(math.ceil((float(total) / cell_budget) ** (1.0 / 3))))
+    points = np.concatenate([points for points in arrays.values() if len(points)])
+    while True:
+        if np.unique(_block_keys(points, block)[0]).size <= cell_budget:
+            return block
+        block += 1
+
+
+def render_grid(grid, filename, cell_budget=20000, colors=None, marker_size=None, title=None, dpi=100,
+                elev=None, azim=None):
+    """
+    Draw "grid" and save the image in "filename" (format chosen by extension: png, svg, pdf...).
+    Return the block side used: 1 means every cell was drawn.
+        cell_budget -- max markers drawn, at least 1. Over it cells are aggregated in blocks (default: 20000)
+        colors -- dictionary {element: matplotlib color}. Elements not in it get a color from the default cycle
+        marker_size -- marker area (points^2) of a single cell. Default: computed from the grid size
+        title -- image title
+        dpi, elev, azim -- image resolution and view angles
+    """
+    _require_numpy()
+    import matplotlib
+    matplotlib.use("Agg")  # no display needed, even when called from cron
+    import matplotlib.pyplot as plt
+    from mpl_toolkits.mplot3d import Axes3D  # registers the 3d projection
+
+    arrays = grid_arrays(grid)
+    block = choose_block(arrays, cell_budget)
+    if colors is None:
+        colors = {}
+    if marker_size is None:
+        marker_size = max(1.0, 2000.0 / max(grid.grid_size))
+
+    fig = plt.figure(figsize=(8, 8))
+    ax = fig.add_subplot(111, projection='3d')
+    # one marker per block, with the color of its most common element, and a single scatter call: matplotlib sorts
+    # the markers by depth within a scatter only, the last scatter drawn would hide the others
+    elements, centers, counts, majority = downsample_elements(arrays, block)
+    palette = [matplotlib.colors.to_rgba(colors.get(element, "C%d" % (i % 10))) for i, element in enumerate(elements)]
+    # full blocks are as big as the block, sparse ones shrink with their filling
+    sizes = marker_size * block ** 2 * (counts / float(block ** 3)) ** (2.0 / 3)
+    if len(centers):
+        ax.scatter(centers[:, 0], centers[:, 1], centers[:, 2], s=sizes, marker='s', depthshade=False,
+                   c=np.array(palette)[majority])
+    for element, color in zip(elements, palette):
+        ax.scatter([], [], [], marker='s', color=color, label=str(element))  # legend entries
+    ax.set_xlim(1, grid.grid_size[0])
+    ax.set_ylim(1, grid.grid_size[1])
+    ax.set_zlim(1, grid.grid_size[2])
+    ax.set_xlabel('x')
+    ax.set_ylabel('y')
+    ax.set_zlabel('z')
+    ax.view_init(elev, azim)
+    if title is None:
+        title = "%d cells" % len(grid.space) + (" (blocks of %d^3)" % block if block > 1 else "")
+    ax.set_title(title)
+    if 0 < len(arrays) <= 20:
+        ax.legend(loc="upper left")
+    fig.savefig(filename, dpi=dpi)
+    plt.close(fig)
+    return block
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+    from grid import Grid
+
+    side = 100
+    print("Building a %dx%dx%d grid..." % (side, side, side))
+    rng = np.random.RandomState(42)
+    g = Grid(grid_size=(side, side, side))
+    points = np.indices((side, side, side)).reshape(3, -1).T + 1
+    kinds = rng.randint(0, 3, len(points))
+    g.space = dict(zip(map(tuple, points.tolist()), ['abc'[k] for k in kinds]))
+    start = time.time()
+    used_block = render_grid(g, sys.argv[1] if len(sys.argv) > 1 else "grid.png")
+    print("Rendered %d cells in %.2f s (block side %d)" % (len(g.space), time.time() - start, used_block))
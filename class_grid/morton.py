@@ -0,0 +1,314 @@
+#!/usr/bin/env python
+"""
+    File name: morton.py
+    Python Version: 2.7.X
+    Sparse Grid storage keyed by Morton (Z-order) codes instead of (x, y, z) tuples.
+    A Morton code interleaves the bits of the three coordinates (21 bits each) in a single 63 bit integer: one int
+    object per cell instead of a tuple of three, cheaper to hash, and cells close in space get close keys. A box is a
+    range of keys: box queries bisect a sorted copy of the keys and look at the keys in the range only. Writes
+    don't touch the sorted copy: new keys are buffered and deletions remembered, and the next box query merges them
+    in one pass.
+
+    Usage
+        g = MortonGrid({(1, 2, 3): 'a'}, grid_size=(1000, 1000, 1000))   # behaves like a Grid
+        g.place({(4, 5, 6): 'b'})
+        g[1:10, 1:10, 1:10]                                              # key range scan
+"""
+import bisect
+
+try:
+    from collections.abc import MutableMapping
+except ImportError:  # python 2
+    from collections import MutableMapping
+
+from grid import Grid, CoordinatesError
+
+BITS = 21
+MAX_COORDINATE = (1 << BITS) - 1
+# Grids with sides up to this one get tables of the spread coordinates of every axis, about 40 bytes per coordinate:
+# bigger ones, up to MAX_COORDINATE, compute every code with encode() instead of spending hundreds of MB on tables
+TABLE_MAX_SIDE = 1 << 14
+
+
+def _spread(value):
+    # abc -> 00a00b00c: two zero bits after every bit
+    value &= MAX_COORDINATE
+    value = (value | value << 32) & 0x1f00000000ffff
+    value = (value | value << 16) & 0x1f0000ff0000ff
+    value = (value | value << 8) & 0x100f00f00f00f00f
+    value = (value | value << 4) & 0x10c30c30c30c30c3
+    value = (value | value << 2) & 0x1249249249249249
+    return int(value)  # python 2: back to int from the long of the shifts
+
+
+def _compact(value):
+    # inverse of _spread()
+    value &= 0x1249249249249249
+    value = (value ^ (value >> 2)) & 0x10c30c30c30c30c3
+    value = (value ^ (value >> 4)) & 0x100f00f00f00f00f
+    value = (value ^ (value >> 8)) & 0x1f0000ff0000ff
+    value = (value ^ (value >> 16)) & 0x1f00000000ffff
+    value = (value ^ (value >> 32)) & MAX_COORDINATE
+    return int(value)
+
+
+def encode(x, y, z):
+    """
+    Return the Morton code of coordinates from 0 to 2**21 - 1
+    >>> encode(1, 0, 0), encode(0, 1, 0), encode(0, 0, 1), encode(3, 3, 3)
+    (1, 2, 4, 63)
+    >>> decode(encode(1234, 5, 2097151))
+    (1234, 5, 2097151)
+    """
+    return _spread(x) | _spread(y) << 1 | _spread(z) << 2
+
+
+def decode(key):
+    """
+    Return the (x, y, z) coordinates of a Morton code
+    """
+    return _compact(key), _compact(key >> 1), _compact(key >> 2)
+
+
+class MortonSpace(MutableMapping):
+    """
+    Dictionary like {(x, y, z): element} storing {Morton code: element}, used as MortonGrid.space.
+    Coordinates not in the grid are simply missing; storing them raises CoordinatesError.
+
+    Class Attributes:
+        grid_size -- the grid size (x, y, z), every side at most 2**21 - 1. Up to TABLE_MAX_SIDE codes are built
+                     from per axis tables, over it they are computed (slower, but the tables would take 40 bytes per
+                     coordinate of every axis)
+
+    DocTest
+    >>> space = MortonSpace((8, 8, 8))
+    >>> space.update({(1, 1, 1): 'a', (2, 1, 1): 'b', (8, 8, 8): 'c'})
+    >>> space[(2, 1, 1)], (8, 8, 8) in space, (9, 1, 1) in space, len(space)
+    ('b', True, False, 3)
+    >>> sorted(space.box((1, 1, 1), (2, 2, 2)))
+    [(1, 1, 1), (2, 1, 1)]
+    >>> del space[(1, 1, 1)]
+    >>> space[(1, 2, 1)] = 'd'
+    >>> sorted(space.items()), sorted(space.box((1, 1, 1), (2, 2, 2)))
+    ([((1, 2, 1), 'd'), ((2, 1, 1), 'b'), ((8, 8, 8), 'c')], [(1, 2, 1), (2, 1, 1)])
+    """
+
+    def __init__(self, grid_size, cells=None):
+        self.grid_size = tuple(grid_size)
+        if max(self.grid_size) > MAX_COORDINATE:
+            raise CoordinatesError(["Grid size {0} too big for Morton codes: max side is {1}."
+                                    .format(self.grid_size, MAX_COORDINATE), self.grid_size])
+        if max(self.grid_size) <= TABLE_MAX_SIDE:
+            # spread coordinates of every axis, already shifted: a code is three lookups and two ORs
+            self._xs = [_spread(x) for x in range(self.grid_size[0] + 1)]
+            self._ys = [_spread(y) << 1 for y in range(self.grid_size[1] + 1)]
+            self._zs = [_spread(z) << 2 for z in range(self.grid_size[2] + 1)]
+        else:
+            self._xs = self._ys = self._zs = None
+        self._cells = {}
+        self._sorted_keys = []  # sorted codes, as of the last box query
+        self._new_keys = []  # codes added since, unsorted
+        self._deleted_keys = set()  # codes deleted since, still in _sorted_keys or _new_keys
+        if cells:
+            self.update(cells)
+
+    def _key(self, coordinates):
+        try:
+            x, y, z = coordinates
+            if 0 < x <= self.grid_size[0] and 0 < y <= self.grid_size[1] and 0 < z <= self.grid_size[2]:
+                if self._xs is None:
+                    return encode(x, y, z)
+                return self._xs[x] | self._ys[y] | self._zs[z]
+        except (TypeError, ValueError, IndexError):  # not a triple or not integers
+            pass
+        return None
+
+    def __getitem__(self, coordinates):
+        key = self._key(coordinates)
+        if key is None:
+            raise KeyError(coordinates)
+        try:
+            return self._cells[key]
+        except KeyError:
+            raise KeyError(coordinates)
+
+    def get(self, coordinates, default=None):
+        return self._cells.get(self._key(coordinates), default)
+
+    def __contains__(self, coordinates):
+        return self._key(coordinates) in self._cells
+
+    def __setitem__(self, coordinates, element):
+        key = self._key(coordinates)
+        if key is None:
+            raise CoordinatesError(["Coordinates {0} of the '{1}' element are out of bounds."
+                                    .format(coordinates, element), {coordinates: element}])
+        if key not in self._cells:
+            if key in self._deleted_keys:  # still in the sorted codes or in the buffer
+                self._deleted_keys.discard(key)
+            else:
+                self._new_keys.append(key)
+        self._cells[key] = element
+
+    def __delitem__(self, coordinates):
+        key = self._key(coordinates)
+        if key is None or key not in self._cells:
+            raise KeyError(coordinates)
+        del self._cells[key]
+        self._deleted_keys.add(key)
+
+    def __iter__(self):
+        for key in self._cells:
+            yield decode(key)
+
+    def __len__(self):
+        return len(self._cells)
+
+    def items(self):
+        return [(decode(key), element) for key, element in self._cells.items()]
+
+    def clear(self):
+        self._cells.clear()
+        self._sorted_keys = []
+        self._new_keys = []
+        self._deleted_keys = set()
+
+    def _merge_keys(self):
+        """
+        Bring the sorted codes up to date with the writes made since the last box query: deleted codes are dropped
+        and the new ones sorted and merged with a single sort, that finds the two sorted runs
+        """
+        if self._deleted_keys:
+            deleted = self._deleted_keys
+            self._sorted_keys = [key for key in self._sorted_keys if key not in deleted]
+            self._new_keys = [key for key in self._new_keys if key not in deleted]
+            self._deleted_keys = set()
+        if self._new_keys:
+            self._new_keys.sort()
+            self._sorted_keys.extend(self._new_keys)
+            self._sorted_keys.sort()
+            self._new_keys = []
+
+    def _key_range(self, lower, upper):
+        """
+        Return (first, last) positions in the sorted codes of the ones between the codes of "lower" and "upper"
+        """
+        self._merge_keys()
+        low = encode(*lower)
+        high = encode(*upper)
+        return bisect.bisect_left(self._sorted_keys, low), bisect.bisect_right(self._sorted_keys, high)
+
+    def count_in_key_range(self, lower, upper):
+        """
+        Return how many cells have a code between the codes of "lower" and "upper": the cost of box()
+        """
+        first, last = self._key_range(lower, upper)
+        return last - first
+
+    def occupied_in(self, ranges):
+        """
+        Return the occupied coordinates among the ones of "ranges" (one range of coordinates inside the grid per
+        axis), looking up the code of every cell of the region
+        """
+        cells = self._cells
+        ys = [(y, _spread(y) << 1) for y in ranges[1]]
+        zs = [(z, _spread(z) << 2) for z in ranges[2]]
+        found = []
+        for x in ranges[0]:
+            x_code = _spread(x)
+            for y, y_code in ys:
+                xy_code = x_code | y_code
+                for z, z_code in zs:
+                    if xy_code | z_code in cells:
+                        found.append((x, y, z))
+        return found
+
+    def box(self, lower, upper):
+        """
+        Return the occupied coordinates of the box going from "lower" to "upper" (both included), looking at the
+        codes between the codes of the two corners only
+        """
+        first, last = self._key_range(lower, upper)
+        lx, ly, lz = lower
+        ux, uy, uz = upper
+        found = []
+        for key in self._sorted_keys[first:last]:
+            x, y, z = decode(key)
+            if lx <= x <= ux and ly <= y <= uy and lz <= z <= uz:
+                found.append((x, y, z))
+        return found
+
+
+class MortonGrid(Grid):
+    """
+    Grid whose space is a MortonSpace. Sides are limited to 2**21 - 1 cells.
+
+    DocTest
+    >>> g = MortonGrid({(1, 1, 1): 'a'}, grid_size=(100, 100, 100))
+    >>> g.place({(50, 60, 70): 'b', (0, 1, 1): 'a'})
+    True
+    >>> g.is_empty((50, 60, 70)), g.is_empty((2, 1, 1)), g[50, 60, 70]
+    (False, True, 'b')
+    >>> g.fill_box((10, 10, 10), (19, 19, 19), 'c')
+    1000
+    >>> len(g[15:30, 15:30, 15:30]), len(g[::2, ::2, ::2])
+    (125, 126)
+    >>> g.clear_box((1, 1, 1), (20, 20, 20)), sorted(g.space.items())
+    (1001, [((50, 60, 70), 'b')])
+    """
+
+    def __init__(self, elements=None, elements_table=None, grid_size=(10, 10, 10), position_overwriting=True):
+        Grid.__init__(self, elements, elements_table, grid_size, position_overwriting)
+        self.space = MortonSpace(self.grid_size, self.space)
+
+    def _occupied_in(self, ranges):
+        if not (ranges[0] and ranges[1] and ranges[2]):
+            return []
+        lower = (ranges[0][0], ranges[1][0], ranges[2][0])
+        upper = (ranges[0][-1], ranges[1][-1], ranges[2][-1])
+        # the key range can hold many cells outside the box: scan it only when it is shorter than the box. Boxes
+        # smaller than the space don't even need the two bisections.
+        volume = len(ranges[0]) * len(ranges[1]) * len(ranges[2])
+        if volume <= len(self.space) or volume <= self.space.count_in_key_range(lower, upper):
+            return self.space.occupied_in(ranges)
+        found = self.space.box(lower, upper)
+        if any(len(axis_range) > 1 and axis_range[1] - axis_range[0] > 1 for axis_range in ranges):
+            xs, ys, zs = [frozenset(axis_range) for axis_range in ranges]
+            found = [coordinates for coordinates in found
+                     if coordinates[0] in xs and coordinates[1] in ys and coordinates[2] in zs]
+        return found
+
+
+if __name__ == "__main__":
+    import doctest
+    import random
+    import sys
+    import time
+    doctest.testmod()
+
+    # Memory and speed against the tuple keyed dictionary of a Grid
+    size = (1000, 1000, 1000)
+    cells = dict(((random.randint(1, 1000), random.randint(1, 1000), random.randint(1, 1000)), 'a')
+                 for i in range(300000))
+    plain = Grid(cells, grid_size=size)
+    morton = MortonGrid(cells, grid_size=size)
+    tuple_bytes = sys.getsizeof(plain.space) + sum(sys.getsizeof(c) + sum(sys.getsizeof(v) for v in c if v > 256)
+                                                   for c in plain.space)
+    morton.space.count_in_key_range((1, 1, 1), size)  # builds the sorted copy of the codes
+    tables = (morton.space._xs, morton.space._ys, morton.space._zs)
+    morton_bytes = (sys.getsizeof(morton.space._cells) + sum(sys.getsizeof(key) for key in morton.space._cells)
+                    + sys.getsizeof(morton.space._sorted_keys)  # same int objects as the dictionary keys
+                    + sum(sys.getsizeof(table) + sum(sys.getsizeof(code) for code in table) for table in tables))
+    print("%d cells: tuple keys %.1f MB, Morton keys %.1f MB (codes, their sorted copy and the axis tables)"
+          % (len(cells), tuple_bytes / 1e6, morton_bytes / 1e6))
+    queries = [(random.randint(1, 1000), random.randint(1, 1000), random.randint(1, 1000)) for i in range(300000)]
+    for name, g in (("tuple", plain), ("Morton", morton)):
+        start = time.time()
+        for coordinates in queries:
+            g.is_empty(coordinates)
+        lookups = time.time() - start
+        start = time.time()
+        for i in range(100):
+            corner = random.randint(1, 900)
+            g[corner:corner + 100, corner:corner + 100, corner:corner + 100]
+        print("%-6s: %.2f s for 300k is_empty(), %.2f s for 100 boxes of 100^3" % (name, lookups, time.time() - start))
@@ -0,0 +1,324 @@
+#!/usr/bin/env python
+"""
+    File name: shared_grid.py
+    Python Version: 2.7.X
+    Grid stored in shared memory, for many worker processes reading (and writing) the same grid without copies.
+    The block holds a small header (grid size and elements_table) followed by one byte per cell: 0 is void, N is the
+    N-th element of the elements_table. Workers attach to the block by name: nothing but the name is pickled when a
+    SharedGrid is passed to another process.
+    Python >= 3.8 uses multiprocessing.shared_memory, older ones a memory mapped file in /dev/shm.
+
+    Usage
+        g = SharedGrid.create((100, 100, 100), ['a', 'b'])
+        g.place({(1, 2, 3): 'a'})
+        pool.map(work, [g.name] * 8)              # in work(): SharedGrid.attach(name) is a read-only view
+        slabs = SharedGrid.slabs(g.grid_size, 4)  # in worker i: SharedGrid.attach(name, False, slabs[i]) can write
+                                                  # only z layers inside its own slab
+        g.close()
+        g.unlink()                                # the creator frees the memory when everybody is done
+"""
+import ctypes
+import os
+import re
+import struct
+import tempfile
+import uuid
+
+try:
+    import cPickle as pickle
+except ImportError:  # python 3
+    import pickle
+
+try:
+    from collections.abc import MutableMapping
+except ImportError:  # python 2
+    from collections import MutableMapping
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # python < 3.8
+    shared_memory = None
+
+from grid import Grid, CoordinatesError, ElementsError
+
+HEADER = struct.Struct("<4sIIII")  # magic, x size, y size, z size, pickled elements_table length
+MAGIC = b"GRD1"
+DATA_ALIGNMENT = 64
+# Memory mapped files fallback: /dev/shm is RAM backed on linux
+SHM_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+_NOT_OCCUPIED = re.compile(b"[^\x00]")
+
+
+class _SharedBlock:
+    """
+    A named block of shared memory
+    """
+
+    def __init__(self, name, size=0, create=False):
+        self.name = name
+        self._shm = None
+        self._mmap = None
+        if shared_memory is not None:
+            if create:
+                self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            else:
+                try:
+                    # 3.13+: attaching processes must not free the block at their exit
+                    self._shm = shared_memory.SharedMemory(name=name, track=False)
+                except TypeError:
+                    self._shm = shared_memory.SharedMemory(name=name)
+            self.buf = self._shm.buf
+        else:
+            import mmap
+            path = os.path.join(SHM_DIR, name)
+            if create:
+                fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o600)
+                os.ftruncate(fd, size)
+            else:
+                fd = os.open(path, os.O_RDWR)
+            try:
+                self._mmap = mmap.mmap(fd, 0)
+            finally:
+                os.close(fd)
+            self.buf = self._mmap
+        self.size = len(self.buf)
+
+    def close(self):
+        self.buf = None
+        if self._shm is not None:
+            self._shm.close()
+        if self._mmap is not None:
+            self._mmap.close()
+
+    def unlink(self):
+        if self._shm is not None:
+            self._shm.unlink()
+        else:
+            os.unlink(os.path.join(SHM_DIR, self.name))
+
+
+class SharedSpace(MutableMapping):
+    """
+    Dictionary like {(x, y, z): element} view of the cells of a shared block, used as SharedGrid.space.
+    Keys not in the grid, or in void cells, are simply missing. Iterating and len() scan the whole block.
+
+    Class Attributes:
+        grid_size -- the grid size (x, y, z)
+        elements_table -- elements that can be stored, in code order (code 0 is void)
+        readonly -- if True every write raises TypeError
+        slab -- (z_from, z_to) layers this view can write, both included. None means all of them
+    """
+
+    def __init__(self, cells, grid_size, elements_table, readonly=False, slab=None):
+        self._cells = cells
+        self.grid_size = grid_size
+        self.elements_table = list(elements_table)
+        self._codes = dict((element, code + 1) for code, element in enumerate(self.elements_table))
+        self.readonly = readonly
+        self.slab = slab
+        self._row = grid_size[0]
+        self._layer = grid_size[0] * grid_size[1]
+
+    def _index(self, coordinates):
+        try:
+            x, y, z = coordinates
+        except (TypeError, ValueError):
+            return None
+        if not (isinstance(x, int) and isinstance(y, int) and isinstance(z, int)):
+            return None
+        if not (0 < x <= self.grid_size[0] and 0 < y <= self.grid_size[1] and 0 < z <= self.grid_size[2]):
+            return None
+        return (x - 1) + (y - 1) * self._row + (z - 1) * self._layer
+
+    def _writable_index(self, coordinates, element):
+        if self.readonly:
+            raise TypeError("SharedGrid attached read-only")
+        index = self._index(coordinates)
+        if index is None:
+            raise CoordinatesError(["Coordinates {0} of the '{1}' element are out of bounds."
+                                    .format(coordinates, element), {coordinates: element}])
+        if self.slab is not None and not self.slab[0] <= coordinates[2] <= self.slab[1]:
+            raise CoordinatesError(["Coordinates {0} are outside the writable slab {1}."
+                                    .format(coordinates, self.slab), {coordinates: element}])
+        return index
+
+    def __getitem__(self, coordinates):
+        index = self._index(coordinates)
+        if index is None:
+            raise KeyError(coordinates)
+        code = self._cells[index]
+        if not code:
+            raise KeyError(coordinates)
+        return self.elements_table[code - 1]
+
+    def __contains__(self, coordinates):
+        index = self._index(coordinates)
+        return index is not None and self._cells[index] != 0
+
+    def __setitem__(self, coordinates, element):
+        index = self._writable_index(coordinates, element)
+        try:
+            self._cells[index] = self._codes[element]
+        except (KeyError, TypeError):
+            raise ElementsError(["The element '{0}' does not exist in elements_table."
+                                 .format(element), {coordinates: element}])
+
+    def __delitem__(self, coordinates):
+        index = self._writable_index(coordinates, None)
+        if not self._cells[index]:
+            raise KeyError(coordinates)
+        self._cells[index] = 0
+
+    def __iter__(self):
+        row = self._row
+        layer = self._layer
+        # the cells are copied once so that the regular expression engine can skip the void ones at C speed
+        for match in _NOT_OCCUPIED.finditer(self._snapshot()):
+            z, rest = divmod(match.start(), layer)
+            y, x = divmod(rest, row)
+            yield x + 1, y + 1, z + 1
+
+    def _snapshot(self):
+        return ctypes.string_at(ctypes.addressof(self._cells), ctypes.sizeof(self._cells))
+
+    def __len__(self):
+        data = self._snapshot()
+        return len(data) - data.count(b"\x00")
+
+    def clear_slab(self):
+        """
+        Empty every cell of the writable layers
+        """
+        if self.readonly:
+            raise TypeError("SharedGrid attached read-only")
+        z_from, z_to = self.slab if self.slab is not None else (1, self.grid_size[2])
+        start = (z_from - 1) * self._layer
+        end = z_to * self._layer
+        ctypes.memset(ctypes.addressof(self._cells) + start, 0, end - start)
+
+
+class SharedGrid(Grid, object):  # new style: pickle must use __reduce__
+    """
+    Grid whose space lives in a named shared memory block.
+    Create it with SharedGrid.create() and attach to it from other processes with SharedGrid.attach(): never call
+    the constructor directly. An elements_table (max 255 elements, picklable) is mandatory: elements are
+    stored as their position in it.
+
+    DocTest
+    >>> g = SharedGrid.create((4, 4, 4), ['a', 'b'], {(1, 1, 1): 'a'})
+    >>> g.place({(2, 2, 2): 'b', (3, 3, 3): 'z', (9, 9, 9): 'a'})
+    True
+    >>> sorted(g.space.items())
+    [((1, 1, 1), 'a'), ((2, 2, 2), 'b')]
+    >>> reader = SharedGrid.attach(g.name)
+    >>> reader.space[(2, 2, 2)], reader.is_empty((3, 3, 3)), len(reader.space)
+    ('b', True, 2)
+    >>> reader.place({(4, 4, 4): 'a'})
+    Traceback (most recent call last):
+    ...
+    TypeError: SharedGrid attached read-only
+    >>> SharedGrid.slabs(g.grid_size, 3)
+    [(1, 1), (2, 2), (3, 4)]
+    >>> writer = SharedGrid.attach(g.name, readonly=False, slab=(3, 4))
+    >>> writer.place({(4, 4, 4): 'a', (1, 1, 2): 'a'})
+    True
+    >>> sorted(reader.space)
+    [(1, 1, 1), (2, 2, 2), (4, 4, 4)]
+    >>> import pickle
+    >>> pickle.loads(pickle.dumps(reader)).space[(4, 4, 4)]
+    'a'
+    >>> for shared in (reader, writer, g):
+    ...     shared.close()
+    >>> g.unlink()
+    """
+
+    def __init__(self, block, readonly=False, slab=None, position_overwriting=True):
+        magic, size_x, size_y, size_z, table_length = HEADER.unpack_from(bytes(bytearray(block.buf[:HEADER.size])))
+        if magic != MAGIC:
+            raise ValueError("Shared memory block {0} does not hold a SharedGrid".format(block.name))
+        table = pickle.loads(bytes(bytearray(block.buf[HEADER.size:HEADER.size + table_length])))
+        Grid.__init__(self, None, table, (size_x, size_y, size_z), position_overwriting)
+        if slab is not None:
+            slab = (max(1, int(slab[0])), min(size_z, int(slab[1])))
+        self.block = block
+        self.readonly = readonly
+        self.slab = slab
+        offset = self._data_offset(table_length)
+        cells = (ctypes.c_ubyte * (size_x * size_y * size_z)).from_buffer(block.buf, offset)
+        self.space = SharedSpace(cells, self.grid_size, table, readonly, slab)
+
+    def __reduce__(self):
+        # other processes attach to the same block instead of receiving a copy of the cells
+        return _attach, (self.name, self.readonly, self.slab, self.position_overwriting)
+
+    @property
+    def name(self):
+        return self.block.name
+
+    @staticmethod
+    def _data_offset(table_length):
+        return (HEADER.size + table_length + DATA_ALIGNMENT - 1) // DATA_ALIGNMENT * DATA_ALIGNMENT
+
+    @classmethod
+    def create(cls, grid_size, elements_table, elements=None, name=None, position_overwriting=True):
+        """
+        Allocate a new shared block for a grid of "grid_size" and return the SharedGrid owning it.
+        Initial "elements" are validated like in Grid creation.
+        """
+        grid_size = tuple(abs(int(size)) for size in grid_size)
+        elements_table = list(elements_table)
+        if not 0 < len(elements_table) < 256:
+            raise ElementsError(["A SharedGrid needs an elements_table of 1 to 255 elements.", elements_table])
+        if elements:
+            Grid(elements, elements_table, grid_size)  # same checks of a regular Grid creation
+        table = pickle.dumps(elements_table, 2)
+        if name is None:
+            name = "grid_" + uuid.uuid4().hex[:16]
+        block = _SharedBlock(name, cls._data_offset(len(table)) + grid_size[0] * grid_size[1] * grid_size[2],
+                             create=True)
+        header = HEADER.pack(MAGIC, grid_size[0], grid_size[1], grid_size[2], len(table)) + table
+        block.buf[:len(header)] = header
+        g = cls(block, position_overwriting=position_overwriting)
+        if elements:
+            g.space.update(elements)
+        return g
+
+    @classmethod
+    def attach(cls, name, readonly=True, slab=None, position_overwriting=True):
+        """
+        Attach to the shared grid "name". Read-only by default; a writable view can be limited to the z layers of
+        "slab" (z_from, z_to), both included: writes outside it raise CoordinatesError.
+        """
+        return cls(_SharedBlock(name), readonly, slab, position_overwriting)
+
+    @staticmethod
+    def slabs(grid_size, count):
+        """
+        Split the z layers of a grid in "count" slabs (z_from, z_to) as even as possible, one per writer
+        """
+        layers = grid_size[2]
+        count = max(1, min(count, layers))
+        bounds = [1 + layers * i // count for i in range(count + 1)]
+        return [(bounds[i], bounds[i + 1] - 1) for i in range(count)]
+
+    def close(self):
+        """
+        Detach from the shared block. The grid is unusable afterwards.
+        """
+        self.space = {}  # drop the ctypes view: the block can't be closed while it is exported
+        self.block.close()
+
+    def unlink(self):
+        """
+        Free the shared block: to be called once, by the creator, when every process closed it
+        """
+        self.block.unlink()
+
+
+def _attach(name, readonly, slab, position_overwriting):
+    return SharedGrid.attach(name, readonly, slab, position_overwriting)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+"""
+    File name: cli.py
+    Python Version: 2.7.X
+    Single command line entry point for the omnitools helpers.
+    Meant to be started hundreds of times per minute from cron and configuration management, so at import time it
+    loads only sys and argparse: every subcommand imports what it needs when it runs.
+
+    Usage
+        ln -s /path/to/omnitools/cli.py /usr/local/bin/omnitools
+        omnitools bytes2human 100001221
+        omnitools human2bytes 1G
+        omnitools uid2username 0
+        omnitools username2uid root
+        omnitools is_distro CentOS 6 7 && echo "supported"
+        omnitools ensure_dir /var/lib/foo/ --mode 0775
+        omnitools maxbwpertime 1T --rate d --period d
+        omnitools diskusage /home --workers 16
+"""
+import argparse
+import os
+import sys
+
+# bandwidthtools.py lives in the repository root, one level above this file
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def cmd_bytes2human(args):
+    from omnitools import bytes2human
+    print(bytes2human(args.bytes, args.format))
+    return 0
+
+
+def cmd_human2bytes(args):
+    from omnitools import human2bytes
+    print(human2bytes(args.size))
+    return 0
+
+
+def cmd_uid2username(args):
+    from omnitools import uid2username
+    print(uid2username(args.uid))
+    return 0
+
+
+def cmd_username2uid(args):
+    from omnitools import username2uid
+    print(username2uid(args.username))
+    return 0
+
+
+def cmd_is_distro(args):
+    """
+    Exit status is 0 if the current distribution matches, 1 otherwise: meant to be used in shell conditions.
+    """
+    from omnitools import is_distro, is_vsdistro
+    if args.vs:
+        return 0 if is_vsdistro() else 1
+    if args.name is None:
+        sys.stderr.write("is_distro: a distribution name or --vs is required\n")
+        return 2
+    distros = {args.name: args.versions}
+    check_version = len(args.versions) > 0
+    return 0 if is_distro(distros, check_version, args.minor) else 1
+
+
+def cmd_ensure_dir(args):
+    from omnitools import ensure_dir
+    ensure_dir(args.path, int(args.mode, 8))
+    return 0
+
+
+def _rate_or_float(value):
+    """
+    maxbwpertime() accepts both h/d/m letters and numbers: give it a float when the user typed a number
+    """
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+def cmd_maxbwpertime(args):
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+    from bandwidthtools import maxbwpertime
+    from omnitools import bytes2human, human2bytes
+    bw_base = float(human2bytes(args.bw))
+    print(bytes2human(maxbwpertime(bw_base, _rate_or_float(args.rate), _rate_or_float(args.period))))
+    return 0
+
+
+def cmd_diskusage(args):
+    from diskusage import scan_disk_usage
+    print(scan_disk_usage(args.root, args.workers, not args.cross_file_systems).format(args.top))
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="omnitools", description="Scripting helpers for linux servers")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="log helpers activity on stderr")
+    subparsers = parser.add_subparsers(dest="command")
+
+    p = subparsers.add_parser("bytes2human", help="translate bytes in human readable format")
+    p.add_argument("bytes", type=int)
+    p.add_argument("--format", default="%(value)i%(symbol)s",
+                   help="formatter with value and symbol keys (default: %%(value)i%%(symbol)s)")
+    p.set_defaults(func=cmd_bytes2human)
+
+    p = subparsers.add_parser("human2bytes", help="translate human readable storage sizes in bytes")
+    p.add_argument("size", help="examples: 1K, 2M, 12G")
+    p.set_defaults(func=cmd_human2bytes)
+
+    p = subparsers.add_parser("uid2username", help="username of the given UserID")
+    p.add_argument("uid", type=int)
+    p.set_defaults(func=cmd_uid2username)
+
+    p = subparsers.add_parser("username2uid", help="UserID of the given username")
+    p.add_argument("username")
+    p.set_defaults(func=cmd_username2uid)
+
+    p = subparsers.add_parser("is_distro", help="exit 0 if the current distribution matches")
+    p.add_argument("name", nargs="?", help="distribution name, example: CentOS")
+    p.add_argument("versions", nargs="*", help="accepted versions, example: 6 7. None means any version")
+    p.add_argument("--minor", action="store_true", help="check also the minor release, example: 6.3")
+    p.add_argument("--vs", action="store_true", help="check against the Vulcania System distros list")
+    p.set_defaults(func=cmd_is_distro)
+
+    p = subparsers.add_parser("ensure_dir", help="create a directory if necessary and set its permissions")
+    p.add_argument("path", help="directory to ensure. Like ensure_dir(), a trailing file part is removed")
+    p.add_argument("--mode", default="0775", help="octal permissions (default: 0775)")
+    p.set_defaults(func=cmd_ensure_dir)
+
+    p = subparsers.add_parser("maxbwpertime", help="bandwidth alert limit from a monthly usable bandwidth")
+    p.add_argument("bw", help="monthly bandwidth limit, examples: 1T, 2M, 12G")
+    p.add_argument("--rate", default="m", help="alert rate: h, d, m or a float (default: m)")
+    p.add_argument("--period", default="m", help="time range: h, d, m or a float (default: m)")
+    p.set_defaults(func=cmd_maxbwpertime)
+
+    p = subparsers.add_parser("diskusage", help="per user and per top level directory disk usage")
+    p.add_argument("root", help="directory to scan")
+    p.add_argument("--workers", type=int, default=8, help="scanning threads (default: 8)")
+    p.add_argument("--top", type=int, default=None, help="show only the biggest N users and directories")
+    p.add_argument("--cross-file-systems", action="store_true",
+                   help="descend in directories mounted from other file systems")
+    p.set_defaults(func=cmd_diskusage)
+
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if getattr(args, "func", None) is None:  # subcommands are not mandatory for argparse on python 3
+        parser.error("a command is required")
+    if args.verbose:
+        import logging
+        logging.basicConfig(level=logging.INFO, format="%(levelname)s - %(message)s")
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+"""
+    File name: diskusage.py
+    Python Version: 2.7.X
+    Per user and per top level directory disk usage report.
+    Directories are read with scandir (os.scandir or the "scandir" backport on python 2) and the stat results of the
+    directory entries are reused, so every file costs one lstat only. Subtrees are spread across a pool of threads:
+    every directory found is queued and picked up by the first free worker.
+
+    Usage
+        python diskusage.py /home
+        python diskusage.py /srv --workers 32 --top 20
+"""
+import os
+import stat
+import threading
+
+from omnitools import bytes2human, uid2username
+
+try:
+    import Queue as queue
+except ImportError:  # python 3
+    import queue
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir  # python 2 backport: pip install scandir
+    except ImportError:
+        scandir = None
+
+
+class _ListdirEntry:
+    """
+    Minimal os.DirEntry replacement used when no scandir implementation is available
+    """
+
+    def __init__(self, directory, name):
+        self.name = name
+        self.path = os.path.join(directory, name)
+        self._stat = None
+
+    def stat(self, follow_symlinks=False):
+        if self._stat is None:
+            self._stat = os.lstat(self.path)
+        return self._stat
+
+    def is_dir(self, follow_symlinks=False):
+        return stat.S_ISDIR(self.stat().st_mode)
+
+
+def _scandir(path):
+    if scandir is not None:
+        return scandir(path)
+    return [_ListdirEntry(path, name) for name in os.listdir(path)]
+
+
+class DiskUsageReport:
+    """
+    Result of a disk usage scan
+
+    Class Attributes:
+        root -- the scanned directory
+        by_uid -- dictionary {uid: [bytes, files]}
+        by_top_dir -- dictionary {top level directory name: [bytes, files]}. Files directly inside root are
+                      accounted under "."
+        total_bytes -- bytes of all the files found
+        total_files -- number of files found (every non directory entry: files, symlinks, sockets...)
+        errors -- list of (path, error string) of the directories and files that could not be read
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.by_uid = {}
+        self.by_top_dir = {}
+        self.total_bytes = 0
+        self.total_files = 0
+        self.errors = []
+
+    def __str__(self):
+        return self.format()
+
+    def merge(self, by_uid, by_top_dir, errors):
+        """
+        Add the partial counters of a worker to the report
+        """
+        for totals, partial in ((self.by_uid, by_uid), (self.by_top_dir, by_top_dir)):
+            for key, counters in partial.items():
+                current = totals.setdefault(key, [0, 0])
+                current[0] += counters[0]
+                current[1] += counters[1]
+        for counters in by_uid.values():
+            self.total_bytes += counters[0]
+            self.total_files += counters[1]
+        self.errors.extend(errors)
+
+    @staticmethod
+    def _username(uid):
+        try:
+            return uid2username(uid)
+        except KeyError:  # no passwd entry: orphan files
+            return str(uid)
+
+    def format(self, top=None):
+        """
+        Return the human readable report. Users and directories are sorted by size, only the first "top" are shown
+        if top is given.
+        """
+        r = "Disk usage of " + self.root + ": " + bytes2human(self.total_bytes) + \
+            " in " + str(self.total_files) + " files\n"
+        r += "\nPer user:\n"
+        for uid, counters in sorted(self.by_uid.items(), key=lambda item: item[1][0], reverse=True)[:top]:
+            r += "\t%-16s %8s %12d files\n" % (self._username(uid), bytes2human(counters[0]), counters[1])
+        r += "\nPer directory:\n"
+        for name, counters in sorted(self.by_top_dir.items(), key=lambda item: item[1][0], reverse=True)[:top]:
+            r += "\t%-16s %8s %12d files\n" % (name, bytes2human(counters[0]), counters[1])
+        if self.errors:
+            r += "\n" + str(len(self.errors)) + " paths could not be read\n"
+        return r
+
+
+def scan_disk_usage(root, workers=8, one_file_system=True, count_hardlinks_once=True):
+    """
+    Walk "root" with a pool of threads and return a DiskUsageReport
+    Symlinks are never followed: their own size is accounted.
+        root -- directory to scan
+        workers -- number of scanning threads. Reading directories is I/O bound, many threads pay off on network
+                   and RAID volumes (default: 8)
+        one_file_system -- if True do not descend in directories mounted from other file systems (default: True)
+        count_hardlinks_once -- if True files with more than one hard link are accounted once only (default: True)
+    """
+    report = DiskUsageReport(root)
+    root_dev = os.lstat(root).st_dev
+    directories = queue.Queue()
+    report_lock = threading.Lock()
+    inodes_lock = threading.Lock()
+    seen_inodes = set()
+
+    def worker():
+        by_uid = {}
+        by_top_dir = {}
+        errors = []
+        while True:
+            item = directories.get()
+            if item is None:
+                directories.task_done()
+                break
+            path, top_dir = item
+            try:
+                entries = _scandir(path)
+                for entry in entries:
+                    try:
+                        st = entry.stat(follow_symlinks=False)
+                    except OSError as e:  # deleted while scanning
+                        errors.append((entry.path, str(e)))
+                        continue
+                    if stat.S_ISDIR(st.st_mode):
+                        if not one_file_system or st.st_dev == root_dev:
+                            directories.put((entry.path, entry.name if top_dir is None else top_dir))
+                        continue
+                    if count_hardlinks_once and st.st_nlink > 1:
+                        inode = (st.st_dev, st.st_ino)
+                        with inodes_lock:
+                            if inode in seen_inodes:
+                                continue
+                            seen_inodes.add(inode)
+                    counters = by_uid.get(st.st_uid)
+                    if counters is None:
+                        counters = by_uid[st.st_uid] = [0, 0]
+                    counters[0] += st.st_size
+                    counters[1] += 1
+                    name = "." if top_dir is None else top_dir
+                    counters = by_top_dir.get(name)
+                    if counters is None:
+                        counters = by_top_dir[name] = [0, 0]
+                    counters[0] += st.st_size
+                    counters[1] += 1
+            except OSError as e:  # permission denied, directory removed while scanning...
+                errors.append((path, str(e)))
+            finally:
+                directories.task_done()
+        with report_lock:
+            report.merge(by_uid, by_top_dir, errors)
+
+    threads = [threading.Thread(target=worker) for _ in range(max(1, int(workers)))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    directories.put((root, None))  # None: children of root are the top level directories
+    directories.join()
+    for _ in threads:
+        directories.put(None)
+    for thread in threads:
+        thread.join()
+
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Per user and per directory disk usage")
+    parser.add_argument("root", help="directory to scan")
+    parser.add_argument("--workers", type=int, default=8, help="scanning threads (default: 8)")
+    parser.add_argument("--top", type=int, default=None, help="show only the biggest N users and directories")
+    parser.add_argument("--cross-file-systems", action="store_true",
+                        help="descend in directories mounted from other file systems")
+    args = parser.parse_args()
+
+    print(scan_disk_usage(args.root, args.workers, not args.cross_file_systems).format(args.top))
@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+"""
+    File name: instrumentation.py
+    Python Version: 2.7.X
+    Opt-in metrics for Grid and LatencyList hot methods: call counters, timing histograms, elements rejected by
+    Grid.place() grouped by exception type and memory size of the watched objects.
+    When instrumentation is disabled the methods are the original ones: there are no wrappers and no checks left
+    around, so the cost is zero. Metrics are exported in Prometheus text format (for example to the node_exporter
+    textfile collector directory) or handed to a callback as a dictionary.
+
+    Usage
+        from instrumentation import Instrumentation, GRID_METHODS, LATENCY_LIST_METHODS
+        metrics = Instrumentation()
+        metrics.instrument(Grid, GRID_METHODS)
+        metrics.instrument(LatencyList, LATENCY_LIST_METHODS)
+        metrics.watch(g, "world")
+        metrics.start_periodic_export(60, path="/var/lib/node_exporter/textfile/omnitools.prom")
+        ...
+        metrics.disable()
+"""
+import bisect
+import os
+import sys
+import threading
+import time
+import weakref
+
+timer = getattr(time, "perf_counter", time.time)
+
+GRID_METHODS = ("place", "is_out_of_bounds", "get_neighbours_coordinates", "is_empty")
+LATENCY_LIST_METHODS = ("add", "average", "get_packetloss", "samp_std_dev", "pop_std_dev")
+
+# Upper bounds (seconds) of the timing histogram buckets, +Inf is implicit
+DURATION_BUCKETS = (1e-6, 5e-6, 1e-5, 5e-5, 1e-4, 5e-4, 1e-3, 5e-3, 1e-2, 5e-2, 0.1, 0.5, 1.0)
+
+
+class _MethodStats:
+    def __init__(self):
+        self.buckets = [0] * (len(DURATION_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+
+
+def container_size(container):
+    """
+    Approximate memory size in bytes of a dictionary (structure plus keys) or of a list (structure plus items).
+    Values of dictionaries are not counted: Grid elements are shared objects.
+    """
+    size = sys.getsizeof(container)
+    if isinstance(container, dict):
+        size += sum(sys.getsizeof(key) for key in container)
+    elif isinstance(container, list):
+        size += sum(sys.getsizeof(item) for item in container if item is not None)
+    return size
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Instrumentation:
+    """
+    Metrics registry that wraps the instrumented methods
+
+    Class Attributes:
+        calls -- dictionary {(class name, method name): _MethodStats}
+        rejections -- dictionary {exception name: elements rejected by Grid.place()}
+        enabled -- True while some method is instrumented
+
+    DocTest
+    >>> import sys
+    >>> sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "class_grid"))
+    >>> from grid import Grid
+    >>> from omnitools import LatencyList
+    >>> original_place = Grid.place
+    >>> metrics = Instrumentation()
+    >>> metrics.instrument(Grid, GRID_METHODS)
+    >>> metrics.instrument(LatencyList, LATENCY_LIST_METHODS)
+    >>> g = Grid()
+    >>> metrics.watch(g, "g")
+    >>> g.place({(1, 1, 1): 'a', (0, 1, 1): 'a', (1.5, 1, 1): 'b'})
+    True
+    >>> metrics.calls[("Grid", "place")].count, metrics.calls[("Grid", "is_out_of_bounds")].count
+    (1, 2)
+    >>> metrics.rejections
+    {'CoordinatesError': 2}
+    >>> text = metrics.prometheus_text()
+    >>> 'omnitools_calls_total{class="Grid",method="place"} 1' in text
+    True
+    >>> 'omnitools_grid_rejected_elements_total{exception="CoordinatesError"} 2' in text
+    True
+    >>> 'omnitools_items{object="g",attribute="space"} 1' in text
+    True
+    >>> metrics.disable()
+    >>> Grid.place == original_place, Grid.rejection_hooks
+    (True, [])
+    """
+
+    def __init__(self):
+        self.calls = {}
+        self.rejections = {}
+        self.enabled = False
+        self._originals = []  # (class, method name, original class attribute)
+        self._watched = []  # (weak reference, name, attribute)
+        self._hooked_classes = []
+        self._lock = threading.Lock()
+        self._exporter = None
+        self._stop_export = threading.Event()
+
+    # ==== Instrumenting ====
+
+    def _wrap(self, function, key):
+        stats = self.calls.setdefault(key, _MethodStats())
+        lock = self._lock
+
+        def instrumented(*args, **kwargs):
+            start = timer()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = timer() - start
+                with lock:
+                    stats.count += 1
+                    stats.total += elapsed
+                    stats.buckets[bisect.bisect_left(DURATION_BUCKETS, elapsed)] += 1
+
+        instrumented.__name__ = function.__name__
+        instrumented.__doc__ = function.__doc__
+        return instrumented
+
+    def instrument(self, cls, method_names):
+        """
+        Replace the "method_names" of "cls" with counting and timing wrappers.
+        If cls has "rejection_hooks" (like Grid) the rejected elements are counted too.
+        """
+        for name in method_names:
+            original = cls.__dict__[name]
+            key = (cls.__name__, name)
+            if isinstance(original, staticmethod):
+                wrapped = staticmethod(self._wrap(original.__get__(None, cls), key))
+            else:
+                wrapped = self._wrap(original, key)
+            self._originals.append((cls, name, original))
+            setattr(cls, name, wrapped)
+        hooks = getattr(cls, "rejection_hooks", None)
+        if hooks is not None and self._count_rejection not in hooks:
+            hooks.append(self._count_rejection)
+            self._hooked_classes.append(cls)
+        self.enabled = True
+
+    def disable(self):
+        """
+        Give back the original methods and stop the periodic export: from now on instrumentation costs nothing
+        """
+        while self._originals:
+            cls, name, original = self._originals.pop()
+            setattr(cls, name, original)
+        for cls in self._hooked_classes:
+            cls.rejection_hooks.remove(self._count_rejection)
+        self._hooked_classes = []
+        self.enabled = False
+        self.stop_periodic_export()
+
+    def _count_rejection(self, exc):
+        name = exc.__class__.__name__
+        with self._lock:
+            self.rejections[name] = self.rejections.get(name, 0) + 1
+
+    def watch(self, obj, name, attribute=None):
+        """
+        Report memory size and length of "attribute" of "obj" ("space" for a Grid, "latencies" for a LatencyList
+        when not given). Objects are weakly referenced: they disappear from the metrics once deleted.
+        """
+        if attribute is None:
+            attribute = "space" if hasattr(obj, "space") else "latencies"
+        self._watched.append((weakref.ref(obj), name, attribute))
+
+    # ==== Exporting ====
+
+    def snapshot(self):
+        """
+        Return the current metrics as a dictionary:
+            {"calls": {(class, method): {"count": n, "sum": seconds, "buckets": [(le, cumulative count), ...]}},
+             "rejections": {exception name: n},
+             "memory": {(object name, attribute): {"bytes": n, "items": n}}}
+        """
+        calls = {}
+        with self._lock:
+            for key, stats in self.calls.items():
+                cumulative = []
+                running = 0
+                for bound, count in zip(DURATION_BUCKETS + (float("inf"),), stats.buckets):
+                    running += count
+                    cumulative.append((bound, running))
+                calls[key] = {"count": stats.count, "sum": stats.total, "buckets": cumulative}
+            rejections = dict(self.rejections)
+        memory = {}
+        alive = []
+        for reference, name, attribute in self._watched:
+            obj = reference()
+            if obj is None:
+                continue
+            alive.append((reference, name, attribute))
+            container = getattr(obj, attribute)
+            memory[(name, attribute)] = {"bytes": container_size(container), "items": len(container)}
+        self._watched = alive
+        return {"calls": calls, "rejections": rejections, "memory": memory}
+
+    def prometheus_text(self, snapshot=None):
+        """
+        Return the metrics in Prometheus text exposition format
+        """
+        if snapshot is None:
+            snapshot = self.snapshot()
+        lines = ["# HELP omnitools_calls_total Calls of instrumented methods.",
+                 "# TYPE omnitools_calls_total counter"]
+        for (cls, method), stats in sorted(snapshot["calls"].items()):
+            lines.append('omnitools_calls_total{class="%s",method="%s"} %d' % (cls, method, stats["count"]))
+        lines += ["# HELP omnitools_call_duration_seconds Duration of instrumented method calls.",
+                  "# TYPE omnitools_call_duration_seconds histogram"]
+        for (cls, method), stats in sorted(snapshot["calls"].items()):
+            labels = 'class="%s",method="%s"' % (cls, method)
+            for bound, count in stats["buckets"]:
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append('omnitools_call_duration_seconds_bucket{%s,le="%s"} %d' % (labels, le, count))
+            lines.append('omnitools_call_duration_seconds_sum{%s} %r' % (labels, stats["sum"]))
+            lines.append('omnitools_call_duration_seconds_count{%s} %d' % (labels, stats["count"]))
+        lines += ["# HELP omnitools_grid_rejected_elements_total Elements rejected by Grid.place().",
+                  "# TYPE omnitools_grid_rejected_elements_total counter"]
+        for exception, count in sorted(snapshot["rejections"].items()):
+            lines.append('omnitools_grid_rejected_elements_total{exception="%s"} %d' % (exception, count))
+        lines += ["# HELP omnitools_memory_bytes Approximate memory size of watched objects.",
+                  "# TYPE omnitools_memory_bytes gauge"]
+        for (name, attribute), sizes in sorted(snapshot["memory"].items()):
+            lines.append('omnitools_memory_bytes{object="%s",attribute="%s"} %d'
+                         % (_escape(name), attribute, sizes["bytes"]))
+        lines += ["# HELP omnitools_items Length of watched objects.",
+                  "# TYPE omnitools_items gauge"]
+        for (name, attribute), sizes in sorted(snapshot["memory"].items()):
+            lines.append('omnitools_items{object="%s",attribute="%s"} %d' % (_escape(name), attribute, sizes["items"]))
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        """
+        Write the metrics in "path" atomically (temporary file and rename), as the textfile collectors want
+        """
+        temporary = "%s.%d.tmp" % (path, os.getpid())
+        with open(temporary, "w") as f:
+            f.write(self.prometheus_text())
+        os.rename(temporary, path)
+
+    def export(self, path=None, callback=None):
+        """
+        Write the metrics in "path" and/or pass snapshot() to "callback"
+        """
+        if path is not None:
+            self.write_prometheus(path)
+        if callback is not None:
+            callback(self.snapshot())
+
+    def start_periodic_export(self, interval, path=None, callback=None):
+        """
+        Export the metrics every "interval" seconds from a background thread
+        """
+        self.stop_periodic_export()
+        self._stop_export.clear()
+
+        def loop():
+            while not self._stop_export.wait(interval):
+                self.export(path, callback)
+
+        self._exporter = threading.Thread(target=loop)
+        self._exporter.daemon = True
+        self._exporter.start()
+
+    def stop_periodic_export(self):
+        if self._exporter is not None:
+            self._stop_export.set()
+            self._exporter.join()
+            self._exporter = None
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+"""
+    File name: latency_anomaly.py
+    Python Version: 2.7.X
+    Online latency anomaly detection, fed sample by sample instead of polling average() and samp_std_dev().
+    Every series (a ping target, a link...) keeps a handful of numbers: an EWMA baseline of mean and variance, the two
+    sides of a CUSUM on the standardized samples and an EWMA of the packet loss. A sample costs O(1), whatever the
+    window, and 50000 series take about 15 MB.
+    Anomalies:
+        spike -- a single sample farther than "spike_threshold" standard deviations over the baseline
+        increase / decrease -- a sustained shift of the latency level (CUSUM change point)
+        loss -- the packet loss EWMA went over "loss_threshold" (reported again once it got below half of it)
+
+    Usage
+        detector = AnomalyDetector(callback=alert)
+        l = MonitoredLatencyList([], 15, detector, "8.8.8.8")
+        l.add(12.3)       # alert(Anomaly(...)) is called when something happens
+        # or, without LatencyLists
+        detector.update("8.8.8.8", 12.3)
+"""
+import math
+from collections import namedtuple
+
+from omnitools import LatencyList
+
+# series -- the series name; kind -- "spike", "increase", "decrease" or "loss"; value -- the latency (the loss
+# rate for "loss"); baseline -- the mean latency before the sample; score -- standard deviations, CUSUM or loss rate
+Anomaly = namedtuple("Anomaly", "series kind value baseline score")
+
+
+class _SeriesState(object):
+    __slots__ = ("count", "mean", "variance", "high", "low", "loss", "loss_alarm")
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.variance = 0.0
+        self.high = 0.0
+        self.low = 0.0
+        self.loss = 0.0
+        self.loss_alarm = False
+
+
+class AnomalyDetector:
+    """
+    Detector of latency anomalies over many series. Not thread safe: feed it from a single thread (or through a
+    ConcurrentLatencyRecorder whose latency_list is a MonitoredLatencyList).
+
+    Class Attributes:
+        alpha -- weight of a new sample in the mean and variance baseline (default: 0.05)
+        warmup -- samples of a series used to build the baseline before reporting anything (default: 20)
+        min_std -- floor of the baseline standard deviation in ms, flat series would alert on noise otherwise
+                   (default: 0.5)
+        spike_threshold -- standard deviations over the baseline of a spike (default: 4.0)
+        cusum_drift -- standard deviations of drift ignored by the CUSUM (default: 0.5)
+        cusum_threshold -- CUSUM value of a level shift (default: 8.0)
+        loss_alpha -- weight of a new sample in the packet loss EWMA (default: 0.1)
+        loss_threshold -- packet loss rate of a loss anomaly (default: 0.2)
+        callback -- function called with every Anomaly (default: None)
+        series -- dictionary {series name: state}
+
+    DocTest
+    >>> found = []
+    >>> detector = AnomalyDetector(callback=found.append)
+    >>> for i in range(40):
+    ...     anomalies = detector.update("a", 20.0 + i % 3)
+    >>> found
+    []
+    >>> detector.update("a", 80.0)[0].kind
+    'spike'
+    >>> for i in range(15):
+    ...     anomalies = detector.update("a", 22.0 + i % 3)
+    >>> [anomaly.kind for anomaly in found]
+    ['spike', 'increase']
+    >>> anomalies = detector.update_many("a", [None] * 3)
+    >>> anomalies[0].kind, round(anomalies[0].score, 3)
+    ('loss', 0.271)
+    >>> round(detector.baseline("a")[0], 1), len(detector)
+    (22.1, 1)
+    """
+
+    def __init__(self, alpha=0.05, warmup=20, min_std=0.5, spike_threshold=4.0, cusum_drift=0.5,
+                 cusum_threshold=8.0, loss_alpha=0.1, loss_threshold=0.2, callback=None):
+        self.alpha = alpha
+        self.warmup = warmup
+        self.min_std = min_std
+        self.spike_threshold = spike_threshold
+        self.cusum_drift = cusum_drift
+        self.cusum_threshold = cusum_threshold
+        self.loss_alpha = loss_alpha
+        self.loss_threshold = loss_threshold
+        self.callback = callback
+        self.series = {}
+
+    def __len__(self):
+        return len(self.series)
+
+    def update(self, series, latency):
+        """
+        Feed a latency (None for a lost packet) of "series" and return the list of anomalies it caused
+        """
+        state = self.series.get(series)
+        if state is None:
+            state = self.series[series] = _SeriesState()
+        anomalies = []
+
+        lost = latency is None
+        state.loss += self.loss_alpha * ((1.0 if lost else 0.0) - state.loss)
+        if state.loss_alarm:
+            state.loss_alarm = state.loss >= self.loss_threshold / 2
+        elif state.loss >= self.loss_threshold:
+            state.loss_alarm = True
+            anomalies.append(Anomaly(series, "loss", state.loss, state.mean, state.loss))
+
+        if not lost:
+            state.count += 1
+            if state.count == 1:
+                state.mean = float(latency)
+            else:
+                mean = state.mean
+                std = max(math.sqrt(state.variance), self.min_std)
+                if state.count > self.warmup:
+                    score = (latency - mean) / std
+                    if score > self.spike_threshold:
+                        anomalies.append(Anomaly(series, "spike", latency, mean, score))
+                    # CUSUM of the standardized samples, a spike counts as spike_threshold at most
+                    score = max(-self.spike_threshold, min(score, self.spike_threshold))
+                    state.high = max(0.0, state.high + score - self.cusum_drift)
+                    state.low = max(0.0, state.low - score - self.cusum_drift)
+                    if state.high > self.cusum_threshold:
+                        anomalies.append(Anomaly(series, "increase", latency, mean, state.high))
+                        state.high = state.low = 0.0
+                    elif state.low > self.cusum_threshold:
+                        anomalies.append(Anomaly(series, "decrease", latency, mean, state.low))
+                        state.high = state.low = 0.0
+                # spikes move the baseline as much as a sample spike_threshold deviations away
+                limit = self.spike_threshold * std
+                difference = max(-limit, min(latency - mean, limit))
+                increment = self.alpha * difference
+                state.mean = mean + increment
+                state.variance = (1 - self.alpha) * (state.variance + difference * increment)
+
+        if anomalies and self.callback is not None:
+            for anomaly in anomalies:
+                self.callback(anomaly)
+        return anomalies
+
+    def update_many(self, series, latencies):
+        """
+        Feed a batch of latencies of "series", oldest first, and return the list of anomalies they caused
+        """
+        anomalies = []
+        for latency in latencies:
+            anomalies.extend(self.update(series, latency))
+        return anomalies
+
+    def baseline(self, series):
+        """
+        Return (mean, standard deviation, packet loss rate) of "series" as currently estimated, None if unknown
+        """
+        state = self.series.get(series)
+        if state is None:
+            return None
+        return state.mean, math.sqrt(state.variance), state.loss
+
+    def reset(self, series=None):
+        """
+        Forget "series" (every series if None): its baseline will be built again from the next samples
+        """
+        if series is None:
+            self.series = {}
+        else:
+            self.series.pop(series, None)
+
+
+class MonitoredLatencyList(LatencyList):
+    """
+    LatencyList feeding an AnomalyDetector with every latency added
+
+    Class Attributes:
+        detector -- the AnomalyDetector (default: a new one)
+        series -- name of this list in the detector (default: the list itself)
+
+    DocTest
+    >>> l = MonitoredLatencyList([], 10, series="link")
+    >>> l.add_many([5.0, 5.5, 6.0, 5.0] * 10)
+    >>> l.length(), l.detector.baseline("link")[2]
+    (40, 0.0)
+    >>> l.add(50.0)
+    >>> l.last_anomalies[0].kind
+    'spike'
+    """
+
+    def __init__(self, latencies=None, used_latencies=15, detector=None, series=None):
+        LatencyList.__init__(self, latencies, used_latencies)
+        self.detector = detector if detector is not None else AnomalyDetector()
+        self.series = series if series is not None else self
+        self.last_anomalies = []
+
+    def add(self, latency):
+        LatencyList.add(self, latency)
+        self.last_anomalies = self.detector.update(self.series, latency)
+
+    def add_many(self, latencies):
+        latencies = list(latencies)
+        LatencyList.add_many(self, latencies)
+        self.last_anomalies = self.detector.update_many(self.series, latencies)
+
+
+if __name__ == "__main__":
+    import doctest
+    import random
+    import sys
+    import time
+    doctest.testmod()
+
+    # Throughput and memory with many series
+    series_count = 50000
+    detector = AnomalyDetector()
+    start = time.time()
+    for round_number in range(10):
+        for target in range(series_count):
+            detector.update(target, None if random.random() < 0.01 else random.gauss(30, 2))
+    elapsed = time.time() - start
+    state = detector.series[0]
+    state_size = sys.getsizeof(state) + sum(sys.getsizeof(getattr(state, name)) for name in _SeriesState.__slots__)
+    print("%d series: %.0f samples/s, about %d bytes of state per series"
+          % (series_count, series_count * 10 / elapsed, state_size))
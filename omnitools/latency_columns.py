@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+"""
+    File name: latency_columns.py
+    Python Version: 2.7.X
+    Columnar latency storage and export, for analysis with numpy/pandas without converting lists of floats and Nones.
+    LatencyRing keeps the last "capacity" samples of a target and their timestamps in two C arrays of doubles (NaN
+    is a lost packet): the window is exposed through the buffer protocol (memoryview) and as numpy arrays that share
+    its memory. Every sample is written twice, at i and i + capacity, so the window is always contiguous and never
+    has to be copied to be viewed.
+    export_columns() writes many targets in a single table (target, timestamp, latency): Parquet when pyarrow is
+    installed, a numpy .npy structured array otherwise.
+
+    Usage
+        rings = dict((target, LatencyRing(3600)) for target in targets)
+        rings["8.8.8.8"].add(12.3)
+        rings["8.8.8.8"].add(None)                       # lost
+        timestamps, latencies = rings["8.8.8.8"].as_numpy()
+        export_columns("latencies.parquet", rings)     # or latencies.npy without pyarrow
+"""
+import ctypes
+import time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+NAN = float("nan")
+
+
+def _view(buffer):
+    view = memoryview(buffer)
+    if hasattr(view, "cast"):  # python 3: ctypes exports the "<d" format, that memoryview can't slice
+        view = view.cast("B").cast("d")
+    return view
+
+
+def _require_numpy():
+    if numpy is None:
+        raise ImportError("numpy is required for numpy views and exports")
+
+
+class LatencyRing:
+    """
+    Fixed capacity window of latencies and timestamps stored as C doubles
+
+    Class Attributes:
+        capacity -- samples kept, older ones are overwritten (FIFO like LatencyList.max_width)
+
+    DocTest
+    >>> ring = LatencyRing(4)
+    >>> ring.add_many([10.0, None, 12.5], [1.0, 2.0, 3.0])
+    >>> ring.add(11.0, 4.0)
+    >>> ring.add(9.5, 5.0)
+    >>> len(ring), len(ring.latencies()), len(ring.latencies().tobytes())
+    (4, 4, 32)
+    >>> timestamps, latencies = ring.as_numpy()
+    >>> timestamps.tolist(), latencies.tolist()
+    ([2.0, 3.0, 4.0, 5.0], [nan, 12.5, 11.0, 9.5])
+    >>> float(numpy.nanmean(latencies)), int(numpy.isnan(latencies).sum())
+    (11.0, 1)
+    >>> ring.latency_list(2).get_used_latencies()
+    [11.0, 9.5]
+    """
+
+    def __init__(self, capacity=1024):
+        self.capacity = int(capacity)
+        self._latencies = (ctypes.c_double * (2 * self.capacity))()
+        self._timestamps = (ctypes.c_double * (2 * self.capacity))()
+        self._next = 0  # position of the next sample in [0, capacity)
+        self._length = 0
+
+    def __len__(self):
+        return self._length
+
+    def add(self, latency, timestamp=None):
+        """
+        Add a latency in ms (None for a lost packet) taken at "timestamp" (default: now, in seconds since epoch)
+        """
+        position = self._next
+        value = NAN if latency is None else latency
+        self._latencies[position] = self._latencies[position + self.capacity] = value
+        if timestamp is None:
+            timestamp = time.time()
+        self._timestamps[position] = self._timestamps[position + self.capacity] = timestamp
+        self._next = (position + 1) % self.capacity
+        if self._length < self.capacity:
+            self._length += 1
+
+    def add_many(self, latencies, timestamps=None):
+        """
+        Add a batch of latencies with slice copies. "timestamps" defaults to now for all of them.
+        """
+        values = [NAN if latency is None else latency for latency in latencies]
+        if timestamps is None:
+            timestamps = [time.time()] * len(values)
+        else:
+            timestamps = list(timestamps)
+            if len(timestamps) != len(values):
+                raise ValueError("{0} latencies but {1} timestamps".format(len(values), len(timestamps)))
+        capacity = self.capacity
+        if len(values) > capacity:
+            values = values[-capacity:]
+            timestamps = timestamps[-capacity:]
+        count = len(values)
+        position = self._next
+        first = min(count, capacity - position)  # samples before wrapping around
+        for column, data in ((self._latencies, values), (self._timestamps, timestamps)):
+            for base in (0, capacity):
+                column[base + position:base + position + first] = data[:first]
+                column[base:base + count - first] = data[first:]
+        self._next = (position + count) % capacity
+        self._length = min(self._length + count, capacity)
+
+    def _window(self):
+        start = (self._next - self._length) % self.capacity
+        return start, start + self._length
+
+    def latencies(self):
+        """
+        Return a memoryview of the latencies, oldest first. It shares the memory of the ring: later adds change it.
+        """
+        start, end = self._window()
+        return _view(self._latencies)[start:end]
+
+    def timestamps(self):
+        """
+        Return a memoryview of the timestamps, oldest first. It shares the memory of the ring: later adds change it.
+        """
+        start, end = self._window()
+        return _view(self._timestamps)[start:end]
+
+    def as_numpy(self):
+        """
+        Return (timestamps, latencies) numpy arrays sharing the memory of the ring: copy them to keep them
+        """
+        _require_numpy()
+        start, end = self._window()
+        return (numpy.frombuffer(self._timestamps, numpy.float64, end - start, start * 8),
+                numpy.frombuffer(self._latencies, numpy.float64, end - start, start * 8))
+
+    def latency_list(self, used_latencies=15):
+        """
+        Return the window as a LatencyList, for its statistics
+        """
+        from omnitools import LatencyList
+        start, end = self._window()
+        latency_list = LatencyList([None if value != value else value for value in self._latencies[start:end]],
+                                   used_latencies)
+        latency_list.max_width = self.capacity
+        return latency_list
+
+
+def _columns(series):
+    """
+    Return (targets, counts, timestamps, latencies) of a {target: LatencyRing or LatencyList} dictionary, the last
+    two as numpy arrays of all the targets one after the other. LatencyLists have no timestamps: NaN.
+    """
+    targets = []
+    counts = []
+    timestamp_parts = []
+    latency_parts = []
+    for target in sorted(series):
+        samples = series[target]
+        if isinstance(samples, LatencyRing):
+            timestamps, latencies = samples.as_numpy()
+        else:
+            latencies = numpy.frombuffer(samples.as_array(), numpy.float64)
+            timestamps = numpy.full(len(latencies), numpy.nan)
+        targets.append(str(target))
+        counts.append(len(latencies))
+        timestamp_parts.append(timestamps)
+        latency_parts.append(latencies)
+    if not targets:
+        return [], [], numpy.empty(0), numpy.empty(0)
+    return targets, counts, numpy.concatenate(timestamp_parts), numpy.concatenate(latency_parts)
+
+
+def export_columns(path, series, file_format=None):
+    """
+    Write the samples of "series" ({target: LatencyRing or LatencyList}) in a single table with the columns target,
+    timestamp (seconds since epoch, NaN for LatencyLists) and latency (ms, NaN for lost packets).
+        file_format -- "parquet" (needs pyarrow) or "npy". None means parquet if pyarrow is installed (default: None)
+    Return the path written: numpy adds the .npy extension when missing.
+    """
+    _require_numpy()
+    if file_format is None:
+        file_format = "parquet" if pyarrow is not None else "npy"
+    targets, counts, timestamps, latencies = _columns(series)
+    if file_format == "parquet":
+        if pyarrow is None:
+            raise ImportError("pyarrow is required for parquet exports")
+        # dictionary encoding: every target name is stored once
+        indices = numpy.repeat(numpy.arange(len(targets), dtype=numpy.int32), counts)
+        table = pyarrow.table({"target": pyarrow.DictionaryArray.from_arrays(indices, targets),
+                               "timestamp": timestamps, "latency": latencies})
+        pyarrow.parquet.write_table(table, path)
+        return path
+    elif file_format == "npy":
+        width = max([len(target) for target in targets] + [1])
+        table = numpy.empty(len(latencies), dtype=[("target", "S%d" % width), ("timestamp", numpy.float64),
+                                                    ("latency", numpy.float64)])
+        table["target"] = numpy.repeat(numpy.array([target.encode("utf-8") if not isinstance(target, bytes)
+                                                    else target for target in targets], dtype="S%d" % width),
+                                       counts)
+        table["timestamp"] = timestamps
+        table["latency"] = latencies
+        if not path.endswith(".npy"):
+            path += ".npy"
+        numpy.save(path, table)
+        return path
+    else:
+        raise ValueError("file_format must be 'parquet' or 'npy', not {0}".format(file_format))
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+"""
+    File name: latency_recorder.py
+    Python Version: 2.7.X
+    Thread safe latency recording without a global lock on every add.
+    Every writer thread appends to its own buffer; a buffer is merged in the shared LatencyList when it holds
+    "batch_size" samples, and only if nobody else is merging at that moment: writers never wait for each other.
+    Readers merge every pending buffer and compute statistics on a consistent copy of the window.
+    Samples of the same thread keep their order, samples of different threads are ordered by merge time.
+
+    Usage
+        recorder = ConcurrentLatencyRecorder(LatencyList([], 15))
+        # in every prober thread
+        recorder.add(12.3)
+        recorder.add(None)  # packet lost
+        # anywhere
+        recorder.average(), recorder.get_packetloss()
+"""
+import threading
+from collections import deque
+
+from omnitools import LatencyList
+
+
+class ConcurrentLatencyRecorder:
+    """
+    LatencyList front end for many writer threads
+
+    Class Attributes:
+        latency_list -- the LatencyList receiving the samples. Don't use it directly while writers are running: read
+                        through snapshot() or the statistics methods of the recorder
+        batch_size -- samples a thread buffers before merging them (default: 64)
+
+    DocTest
+    >>> recorder = ConcurrentLatencyRecorder(LatencyList([], 16), batch_size=3)
+    >>> def probe(values):
+    ...     for value in values:
+    ...         recorder.add(value)
+    >>> threads = [threading.Thread(target=probe, args=([10.0, None, 30.0, 20.0],)) for _ in range(4)]
+    >>> for t in threads:
+    ...     t.start()
+    >>> for t in threads:
+    ...     t.join()
+    >>> recorder.pending() > 0
+    True
+    >>> recorder.snapshot().length(), recorder.pending()
+    (16, 0)
+    >>> recorder.get_packetloss(), recorder.average()
+    (0.25, 20.0)
+    """
+
+    def __init__(self, latency_list=None, batch_size=64):
+        self.latency_list = latency_list if latency_list is not None else LatencyList()
+        self.batch_size = batch_size
+        self._local = threading.local()
+        self._buffers = []  # (thread, buffer) of every writer thread
+        self._buffers_lock = threading.Lock()
+        self._merge_lock = threading.Lock()
+
+    def _thread_buffer(self):
+        try:
+            return self._local.buffer
+        except AttributeError:
+            buffer = deque()  # append and popleft are atomic: the owner appends while a reader drains
+            with self._buffers_lock:
+                self._buffers.append((threading.current_thread(), buffer))
+            self._local.buffer = buffer
+            return buffer
+
+    def add(self, latency):
+        """
+        Record a latency (None for a lost packet) from the calling thread
+        """
+        buffer = self._thread_buffer()
+        buffer.append(latency)
+        # if somebody else is merging keep buffering: the batch will be merged next time
+        if len(buffer) >= self.batch_size and self._merge_lock.acquire(False):
+            try:
+                self._drain(buffer)
+            finally:
+                self._merge_lock.release()
+
+    def _drain(self, buffer):
+        # only the owner appends and only one thread at a time drains: len() can only grow meanwhile
+        popleft = buffer.popleft
+        self.latency_list.add_many([popleft() for _ in range(len(buffer))])
+
+    def flush(self):
+        """
+        Merge the samples buffered by every thread in latency_list
+        """
+        with self._merge_lock:
+            self._flush()
+
+    def _flush(self):
+        with self._buffers_lock:
+            buffers = list(self._buffers)
+        for thread, buffer in buffers:
+            self._drain(buffer)
+        # forget the buffers of the threads gone away, once drained
+        with self._buffers_lock:
+            self._buffers = [(thread, buffer) for thread, buffer in self._buffers
+                             if thread.is_alive() or len(buffer) > 0]
+
+    def pending(self):
+        """
+        Return the number of samples buffered and not merged yet
+        """
+        with self._buffers_lock:
+            return sum(len(buffer) for thread, buffer in self._buffers)
+
+    def snapshot(self):
+        """
+        Merge every pending sample and return a copy of the LatencyList: a consistent window to compute statistics on
+        """
+        with self._merge_lock:
+            self._flush()
+            copy = LatencyList(self.latency_list.latencies, self.latency_list.used_latencies)
+            copy.max_width = self.latency_list.max_width
+        return copy
+
+    def average(self):
+        return self.snapshot().average()
+
+    def max(self):
+        return self.snapshot().max()
+
+    def min(self):
+        return self.snapshot().min()
+
+    def get_packetloss(self):
+        return self.snapshot().get_packetloss()
+
+    def samp_std_dev(self):
+        return self.snapshot().samp_std_dev()
+
+    def pop_std_dev(self):
+        return self.snapshot().pop_std_dev()
+
+
+if __name__ == "__main__":
+    import doctest
+    import time
+    doctest.testmod()
+
+    # Throughput against the "one global lock around every add" approach
+    samples = 200000
+    for writers in (1, 4, 8):
+        lock = threading.Lock()
+        shared = LatencyList([], 15)
+
+        def locked_probe():
+            for i in range(samples // writers):
+                with lock:
+                    shared.add(1.5)
+
+        recorder = ConcurrentLatencyRecorder(LatencyList([], 15))
+
+        def recorder_probe():
+            for i in range(samples // writers):
+                recorder.add(1.5)
+
+        for name, target in (("global lock", locked_probe), ("recorder", recorder_probe)):
+            threads = [threading.Thread(target=target) for _ in range(writers)]
+            start = time.time()
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            print("%d writers, %-11s: %8.0f adds/s" % (writers, name, samples / (time.time() - start)))
@@ -8,11 +8,9 @@
     This module aims to offer a bunch of useful classes and functions for
     scripting inside linux servers
 """
-import math
 import os
-import platform
-import logging
-import pwd
+# math, platform, logging and pwd are imported where they are used: scripts
+# importing omnitools for a single helper should not pay for all of them.
 #import smtplib
 #from email.mime.multipart import MIMEMultipart
 #from email.mime.text import MIMEText
@@ -46,6 +44,8 @@ def ensure_dir(dir_path, dir_permissions=0775):
         ensure_dir("./dir2/foo/", 777)
     """
 
+    import logging
+
     # if path like /dir1/dir2/file3 it remove the file part
     d = os.path.dirname(dir_path)
     dp = dir_permissions
@@ -118,6 +118,7 @@ def uid2username(userid):
     >>> uid2username(0)
     'root'
     """
+    import pwd
     return pwd.getpwuid(userid)[0]
 
 
@@ -127,6 +128,7 @@ def username2uid(username):
     >>> username2uid("root")
     0
     """
+    import pwd
     return pwd.getpwnam(username)[2]
 
 
@@ -189,6 +191,7 @@ def is_distro(distros=None, check_version=True, check_minor_release=False):
         raise TypeError("Distros should be dict or list of dicts")
 
     # Getting tuple in the ("Centos", 5.6") style cutting the codename version
+    import platform
     current_distro_string = list(platform.linux_distribution())[:2]
 
     # Distro name
@@ -351,9 +354,39 @@ class LatencyList:
             self.remove()
         self.latencies.append(latency)
 
+    def add_many(self, latencies):
+        """
+        Add a batch of latencies at once, discharging the old ones with a single cut. The result is the same of
+        calling add() for each of them, except that at most max_width latencies are kept.
+        >>> l = LatencyList([1, 2, 3])
+        >>> l.max_width = 4
+        >>> l.add_many([4, None, 6])
+        >>> l.latencies
+        [3, 4, None, 6]
+        """
+        self.latencies.extend(latencies)
+        overflow = self.length() - self.max_width
+        if overflow > 0:
+            del self.latencies[:overflow]
+
     def remove(self):
         self.latencies.pop(0)
 
+    def as_array(self, used_only=False):
+        """
+        Return the latencies as an array('d') of doubles, NaN for packets lost: a contiguous buffer that numpy
+        (numpy.frombuffer) and pandas can use without converting every value again.
+        The array is a copy: for zero copy views of a live window see latency_columns.LatencyRing.
+            used_only -- if True only the last "used_latencies" are returned
+        >>> a = LatencyList([1.5, None, 3]).as_array()
+        >>> a[0], a[1] != a[1], a[2]
+        (1.5, True, 3.0)
+        """
+        from array import array
+        nan = float("nan")
+        latencies = self.get_used_latencies() if used_only else self.latencies
+        return array("d", [nan if latency is None else latency for latency in latencies])
+
     def average(self):
         return round(reduce(
             lambda x, y: x + y / float(len(self.get_used_latencies(True))), self.get_used_latencies(True),
@@ -378,12 +411,14 @@ class LatencyList:
         """
         Standard Deviation of a Sample
         """
+        import math
         return math.sqrt(self.variations_sum() / (len(self.get_used_latencies(True))-1))
 
     def pop_std_dev(self):
         """
         Standard Deviation of a Population
         """
+        import math
         return math.sqrt(self.variations_sum()/len(self.get_used_latencies(True)))
 
 
@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+"""
+    File name: pingparse.py
+    Python Version: 2.7.X
+    Streaming parser of ping and fping output feeding a LatencyList (or any object with add_many(), like a
+    latency_columns.LatencyRing) per target.
+    Output is read in large blocks and every block is scanned by a single regular expression matching all the known
+    line formats at once: lines of no interest are skipped by the regular expression engine, and samples are handed
+    to their target in one add_many() per block.
+    Known lines (optionally prefixed by the [timestamp] of ping -D / fping -D):
+        ping     64 bytes from 8.8.8.8: icmp_seq=1 ttl=117 time=12.3 ms        (DUP! replies are skipped)
+                 no answer yet for icmp_seq=2 / Request timeout for icmp_seq 2 / From 10.0.0.1 icmp_seq=2 ...
+                 PING 8.8.8.8 (8.8.8.8) 56(84) bytes of data.                   (names the target of the lines)
+        fping    8.8.8.8 : [0], 64 bytes, 12.3 ms (12.3 avg, 0% loss)
+                 8.8.8.8 : [1], timed out (12.3 avg, 50% loss)
+                 8.8.8.8 : 12.30 - 13.00                                       (-C summary, "-" is lost)
+                 8.8.8.8 is alive (12.3 ms) / 8.8.8.8 is unreachable            (-e)
+    Sequence numbers missing between two received ones are lost packets; late and duplicated replies are skipped.
+    A -C summary is ignored for the targets already seen probe by probe, so fping -C with or without -q can be parsed.
+
+    Usage
+        parser = PingParser()                               # a new LatencyList for every target
+        fping = subprocess.Popen(["fping", "-l", "-D"] + targets, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        parser.parse_stream(fping.stdout)                   # until fping exits
+        parser.sinks["8.8.8.8"].average()
+"""
+import os
+import re
+import time
+
+from omnitools import LatencyList
+
+BLOCK_SIZE = 1 << 20
+SEQUENCE_MODULO = 1 << 16  # icmp_seq is 16 bits wide
+
+_LINES = re.compile(br"""
+    ^(?:\[([0-9.]+)\]\ )?                                                       # 1 timestamp
+    (?:(\S+)\ +:\ \[(\d+)\],\ (?:\d+\ bytes,\ ([0-9.]+)\ ms|timed\ out)         # 2 fping target 3 seq 4 ms
+    |\d+\ bytes\ from\ [^\n]*?icmp_seq=(\d+)[^\n]*?\ time[=<]([0-9.]+)\ ?ms([^\n]*)  # 5 ping seq 6 ms 7 rest
+    |(?:no\ answer\ yet\ for\ icmp_seq=|Request\ timeout\ for\ icmp_seq\ |From\ [^\n]*?\ icmp_seq=)(\d+)  # 8 lost
+    |(\S+)\ +:((?:\ +(?:[0-9.]+|-))+)\ *\r?$                                    # 9 summary target 10 values
+    |PING\ (\S+)                                                                # 11 ping target
+    |(\S+)\ is\ alive\ \(([0-9.]+)\ ms\)                                        # 12 target 13 ms
+    |(\S+)\ is\ unreachable                                                     # 14 target
+    )""", re.M | re.X)
+
+
+def _text(data):
+    # target names are bytes in python 3 output
+    return data if isinstance(data, str) else data.decode("utf-8", "replace")
+
+
+def new_latency_list(target):
+    """
+    Default sink factory of PingParser: a LatencyList with default settings for every target
+    """
+    return LatencyList()
+
+
+class PingParser:
+    """
+    Streaming parser of ping/fping output
+
+    Class Attributes:
+        sinks -- dictionary {target: LatencyList or any object with add_many()} receiving the samples
+        factory -- called with a new target name to create its sink; if it returns None (or if factory is None) the
+                   samples of that target are dropped (default: new_latency_list)
+        timestamps -- if True sinks are fed with add_many(latencies, timestamps), as a LatencyRing wants: timestamps
+                      of the lines, or the parse time without -D (default: False)
+        ping_target -- target of ping lines before a "PING target" header (default: "ping")
+        samples, lost, dropped -- samples given to the sinks, how many of them were lost packets, samples of targets
+                                  without a sink
+
+    DocTest
+    Recorded fping -l -D output, with a lost probe (timed out) and a missing one ([3] not printed):
+    >>> parser = PingParser(factory=lambda target: LatencyList([], 5))
+    >>> parser.feed(b'''[1700000000.10000] 8.8.8.8   : [0], 64 bytes, 12.1 ms (12.1 avg, 0% loss)
+    ... [1700000000.10100] 1.1.1.1   : [0], 64 bytes, 8.40 ms (8.40 avg, 0% loss)
+    ... [1700000001.10000] 8.8.8.8   : [1], timed out (12.1 avg, 50% loss)
+    ... [1700000001.10100] 1.1.1.1   : [1], 64 bytes, 8.61 ms (8.50 avg, 0% loss)
+    ... ICMP Host Unreachable from 10.0.0.1 for ICMP Echo sent to 8.8.8.8
+    ... [1700000002.10000] 8.8.8.8   : [2], 64 bytes, 12.5 ms (12.3 avg, 33% loss)
+    ... [1700000004.10000] 8.8.8.8   : [4], 64 bytes, 12.3 ms (12.3 avg, 40''')
+    >>> parser.sinks["8.8.8.8"].latencies, parser.sinks["1.1.1.1"].latencies
+    ([12.1, None, 12.5], [8.4, 8.61])
+    >>> parser.feed(b'% loss)\\n')
+    >>> parser.sinks["8.8.8.8"].latencies, parser.samples, parser.lost
+    ([12.1, None, 12.5, None, 12.3], 7, 2)
+
+    Recorded iputils ping output, with a duplicate, a no answer (-O) and an unreachable reply:
+    >>> parser = PingParser()
+    >>> parser.feed(b'''PING example.org (93.184.216.34) 56(84) bytes of data.
+    ... 64 bytes from 93.184.216.34 (93.184.216.34): icmp_seq=1 ttl=56 time=88.2 ms
+    ... 64 bytes from 93.184.216.34 (93.184.216.34): icmp_seq=1 ttl=56 time=88.9 ms (DUP!)
+    ... no answer yet for icmp_seq=2
+    ... From 10.0.0.1 icmp_seq=3 Destination Host Unreachable
+    ... 64 bytes from 93.184.216.34 (93.184.216.34): icmp_seq=4 ttl=56 time=87.5 ms
+    ...
+    ... --- example.org ping statistics ---
+    ... 4 packets transmitted, 2 received, +1 duplicates, 50% packet loss, time 3004ms
+    ... ''')
+    >>> parser.sinks["example.org"].latencies
+    [88.2, None, None, 87.5]
+
+    Recorded macOS/BSD ping output, counting from icmp_seq=0:
+    >>> parser = PingParser()
+    >>> parser.feed(b'''PING example.org (93.184.216.34): 56 data bytes
+    ... 64 bytes from 93.184.216.34: icmp_seq=0 ttl=56 time=12.500 ms
+    ... 64 bytes from 93.184.216.34: icmp_seq=1 ttl=56 time=12.300 ms
+    ... Request timeout for icmp_seq 2
+    ... 64 bytes from 93.184.216.34: icmp_seq=3 ttl=56 time=12.100 ms
+    ... ''')
+    >>> parser.sinks["example.org"].latencies
+    [12.5, 12.3, None, 12.1]
+
+    Recorded fping -C 3 -q summary, and fping -e:
+    >>> parser = PingParser()
+    >>> parser.feed(b'''8.8.8.8     : 12.30 - 13.00
+    ... 192.0.2.1   : - - -
+    ... 1.1.1.1 is alive (8.41 ms)
+    ... 192.0.2.2 is unreachable
+    ... ''')
+    >>> sorted((target, sink.latencies) for target, sink in parser.sinks.items())
+    [('1.1.1.1', [8.41]), ('192.0.2.1', [None, None, None]), ('192.0.2.2', [None]), ('8.8.8.8', [12.3, None, 13.0])]
+    """
+
+    def __init__(self, sinks=None, factory=new_latency_list, timestamps=False, ping_target="ping"):
+        self.sinks = sinks if sinks is not None else {}
+        self.factory = factory
+        self.timestamps = timestamps
+        self.ping_target = ping_target
+        self.samples = 0
+        self.lost = 0
+        self.dropped = 0
+        self._rest = b""  # last line of the last block, not complete yet
+        self._last_sequence = {}  # target -> last sequence number received
+        self._probed = set()  # targets with per probe lines: their -C summary is a repetition
+
+    def feed(self, data):
+        """
+        Parse a block of output. An incomplete last line is kept for the next block.
+        """
+        if self._rest:
+            data = self._rest + data
+        end = data.rfind(b"\n") + 1
+        self._rest = data[end:]
+        if end:
+            self._parse(data, end)
+
+    def close(self):
+        """
+        Parse the incomplete last line, if any: to be called at the end of the output
+        """
+        if self._rest:
+            data = self._rest + b"\n"
+            self._rest = b""
+            self._parse(data, len(data))
+
+    def parse_stream(self, stream, block_size=BLOCK_SIZE):
+        """
+        Parse a binary file or pipe until its end. Pipes are read as data arrives, not one full block at a time.
+        """
+        if hasattr(stream, "read1"):  # io streams: what is available, up to block_size
+            read = lambda: stream.read1(block_size)
+        else:
+            try:
+                fd = stream.fileno()
+            except (AttributeError, IOError, OSError, ValueError):  # file like objects without a descriptor
+                fd = None
+            if fd is not None:  # python 2 files: read() would wait for a full block
+                read = lambda: os.read(fd, block_size)
+            else:
+                read = lambda: stream.read(block_size)
+        while True:
+            data = read()
+            if not data:
+                break
+            self.feed(data)
+        self.close()
+
+    def parse_file(self, path, block_size=BLOCK_SIZE):
+        """
+        Parse a recorded ping/fping output file
+        """
+        with open(path, "rb") as f:
+            self.parse_stream(f, block_size)
+
+    def _parse(self, data, end):
+        probes = {}  # fping target -> [latencies, timestamps], the common case: handled inline
+        others = {}  # target -> [latencies, timestamps] of every other line
+        summaries = []
+        last_sequence = self._last_sequence
+        keep_timestamps = self.timestamps
+        now = time.time()
+
+        def batch_of(target):
+            batch = others.get(target)
+            if batch is None:
+                batch = others[target] = [[], []]
+            return batch
+
+        def add_probe(batch, target, sequence, latency, timestamp):
+            # sequence numbers missing since the last reply are lost packets, older ones are late or duplicated
+            last = last_sequence.get(target)
+            if last is not None:
+                gap = (sequence - last) % SEQUENCE_MODULO
+                if gap == 0 or gap > SEQUENCE_MODULO // 2:
+                    return
+                if gap > 1:
+                    batch[0].extend([None] * (gap - 1))
+                    batch[1].extend([timestamp] * (gap - 1))
+            last_sequence[target] = sequence
+            batch[0].append(latency)
+            batch[1].append(timestamp)
+
+        for (timestamp, fping_target, fping_sequence, fping_ms, ping_sequence, ping_ms, ping_rest, lost_sequence,
+             summary_target, summary, ping_header, alive_target, alive_ms, unreachable_target) \
+                in _LINES.findall(data, 0, end):
+            if keep_timestamps:
+                timestamp = float(timestamp) if timestamp else now
+            if fping_target:
+                batch = probes.get(fping_target)
+                if batch is None:
+                    batch = probes[fping_target] = [[], []]
+                sequence = int(fping_sequence)
+                if last_sequence.get(fping_target, sequence - 1) + 1 == sequence:  # in order, nothing missing
+                    last_sequence[fping_target] = sequence
+                    batch[0].append(float(fping_ms) if fping_ms else None)
+                    batch[1].append(timestamp)
+                else:
+                    add_probe(batch, fping_target, sequence, float(fping_ms) if fping_ms else None, timestamp)
+            elif ping_sequence:
+                if b"DUP!" not in ping_rest:
+                    add_probe(batch_of(self.ping_target), self.ping_target, int(ping_sequence), float(ping_ms),
+                              timestamp)
+            elif lost_sequence:
+                add_probe(batch_of(self.ping_target), self.ping_target, int(lost_sequence), None, timestamp)
+            elif summary_target:
+                summaries.append((summary_target, summary, timestamp))
+            elif ping_header:
+                self.ping_target = _text(ping_header)
+                # a new run: its first sequence number is taken as it is (iputils starts from 1, BSD ping from 0)
+                last_sequence.pop(self.ping_target, None)
+            elif alive_target:
+                batch = batch_of(alive_target)
+                batch[0].append(float(alive_ms))
+                batch[1].append(timestamp)
+            elif unreachable_target:
+                batch = batch_of(unreachable_target)
+                batch[0].append(None)
+                batch[1].append(timestamp)
+
+        self._probed.update(probes)
+        for target, summary, timestamp in summaries:
+            if target not in self._probed:
+                values = [None if value == b"-" else float(value) for value in summary.split()]
+                batch = batch_of(target)
+                batch[0].extend(values)
+                batch[1].extend([timestamp] * len(values))
+        for batches in (probes, others):
+            for target, (latencies, timestamps) in batches.items():
+                self._dispatch(_text(target), latencies, timestamps)
+
+    def _dispatch(self, target, latencies, timestamps):
+        sink = self.sinks.get(target)
+        if sink is None:
+            sink = self.factory(target) if self.factory is not None else None
+            if sink is None:
+                self.dropped += len(latencies)
+                return
+            self.sinks[target] = sink
+        if self.timestamps:
+            sink.add_many(latencies, timestamps)
+        else:
+            sink.add_many(latencies)
+        self.samples += len(latencies)
+        self.lost += latencies.count(None)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
+
+    # Throughput on fping -l -D output of 1000 targets
+    lines = []
+    for sequence in range(1000):
+        for target in range(1000):
+            if (sequence + target) % 50:
+                lines.append("[1700000000.%05d] 10.0.%d.%d : [%d], 64 bytes, %d.%02d ms (12.0 avg, 0%% loss)\n"
+                             % (sequence, target // 256, target % 256, sequence, 10 + target % 7, sequence % 100))
+            else:
+                lines.append("[1700000000.%05d] 10.0.%d.%d : [%d], timed out (12.0 avg, 2%% loss)\n"
+                             % (sequence, target // 256, target % 256, sequence))
+    data = "".join(lines).encode("ascii")
+    parser = PingParser(factory=lambda target: LatencyList([], 15))
+    start = time.time()
+    for offset in range(0, len(data), BLOCK_SIZE):
+        parser.feed(data[offset:offset + BLOCK_SIZE])
+    parser.close()
+    elapsed = time.time() - start
+    print("%d lines in %.2f s: %.0f lines/s, %d samples, %d lost"
+          % (len(lines), elapsed, len(lines) / elapsed, parser.samples, parser.lost))
@@ -0,0 +1,376 @@
+#!/usr/bin/env python
+"""
+    File name: queuedlogging.py
+    Python Version: 2.7.X
+    Opt-in non blocking logging pipeline for the omnitools helpers.
+    The handlers of a logger (the root one by default, the one used by ensure_dir() and friends) are moved behind a
+    queue: the calling thread only appends the record to the queue and a background listener thread does the
+    formatting and the I/O. Optionally:
+        - a rate limiter drops the messages of the same kind exceeding "rate" per second (the first message passing
+          after a drop tells how many were suppressed)
+        - consecutive identical messages are aggregated in a single "last message repeated N times" line
+    Records are formatted by the listener thread only: the arguments of a logging call are kept as they are, so don't
+    change mutable objects passed as logging arguments after the call.
+
+    Usage
+        import queuedlogging
+        queuedlogging.start_queued_logging(rate=100)
+        for d in many_dirs:
+            ensure_dir(d)
+        queuedlogging.stop_queued_logging()  # flush everything. Called at exit anyway
+
+        with queuedlogging.QueuedLogging(rate=100):
+            ...
+"""
+import atexit
+import logging
+import threading
+import time
+
+try:
+    import Queue as queue
+except ImportError:  # python 3
+    import queue
+
+try:
+    from logging.handlers import QueueHandler, QueueListener
+except ImportError:  # python 2: logging.handlers has no queue support
+    QueueHandler = None
+    QueueListener = None
+
+
+if QueueHandler is None:
+    class QueueHandler(logging.Handler):
+        """
+        Minimal backport of logging.handlers.QueueHandler (python 3.2)
+        """
+
+        def __init__(self, q):
+            logging.Handler.__init__(self)
+            self.queue = q
+
+        def enqueue(self, record):
+            self.queue.put_nowait(record)
+
+        def prepare(self, record):
+            return record
+
+        def emit(self, record):
+            try:
+                self.enqueue(self.prepare(record))
+            except Exception:
+                self.handleError(record)
+
+    class QueueListener(object):
+        """
+        Minimal backport of logging.handlers.QueueListener (python 3.2)
+        """
+        _sentinel = None
+
+        def __init__(self, q, *handlers):
+            self.queue = q
+            self.handlers = handlers
+            self._thread = None
+
+        def start(self):
+            self._thread = threading.Thread(target=self._monitor)
+            self._thread.daemon = True
+            self._thread.start()
+
+        def prepare(self, record):
+            return record
+
+        def handle(self, record):
+            record = self.prepare(record)
+            for handler in self.handlers:
+                handler.handle(record)
+
+        def dequeue(self, block):
+            return self.queue.get(block)
+
+        def _monitor(self):
+            while True:
+                record = self.dequeue(True)
+                if record is self._sentinel:
+                    break
+                self.handle(record)
+
+        def enqueue_sentinel(self):
+            self.queue.put_nowait(self._sentinel)
+
+        def stop(self):
+            self.enqueue_sentinel()
+            self._thread.join()
+            self._thread = None
+
+
+class LazyQueueHandler(QueueHandler):
+    """
+    QueueHandler leaving the formatting to the listener thread.
+    The stdlib QueueHandler formats the message in the calling thread to make records picklable for multiprocessing
+    queues: between threads this is not needed. Records dropped because the queue is full are counted in "dropped".
+    """
+
+    def __init__(self, q):
+        QueueHandler.__init__(self, q)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Token bucket rate limiter for log records.
+    Messages are grouped by logger, level and message template (not the formatted message): every group can log
+    "rate" records per second with bursts up to "burst" records. Records at "exempt_level" or above are never dropped.
+    The first record passing after some drops reports how many of them were suppressed.
+
+    Class Attributes:
+        rate -- records per second allowed for every group
+        burst -- records that can be logged at once after a quiet period
+        exempt_level -- records with this level or above are never dropped (default: logging.ERROR)
+    """
+
+    def __init__(self, rate=10.0, burst=None, exempt_level=logging.ERROR):
+        logging.Filter.__init__(self)
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(1.0, rate))
+        self.exempt_level = exempt_level
+        self._buckets = {}  # (name, levelno, msg) -> [tokens, last refill time, suppressed]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= self.exempt_level:
+            return True
+        key = (record.name, record.levelno, record.msg)
+        now = record.created
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [self.burst, now, 0]
+            else:
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            if bucket[0] < 1.0:
+                bucket[2] += 1
+                return False
+            bucket[0] -= 1.0
+            suppressed = bucket[2]
+            bucket[2] = 0
+        if suppressed:
+            # The template is extended without touching its placeholders: args are still applied lazily
+            record.msg = str(record.msg) + " [" + str(suppressed) + " similar messages suppressed]"
+        return True
+
+
+class AggregatingHandler(logging.Handler):
+    """
+    Dispatch records to "handlers" collapsing consecutive identical ones (same logger, level, template and
+    arguments) in a single "last message repeated N times" record.
+    A pending repetition is written when a different record arrives, on flush/close, or by flush_expired() once it
+    is older than "max_delay" seconds: the QueuedLogging listener calls it while waiting for records.
+    Meant to run in the listener thread only.
+    """
+
+    def __init__(self, handlers, aggregate=True, max_delay=5.0):
+        logging.Handler.__init__(self)
+        self.handlers = list(handlers)
+        self.aggregate = aggregate
+        self.max_delay = max_delay
+        self._last = None
+        self._repeated = 0
+        self._first_repeat = 0.0
+
+    def _dispatch(self, record):
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+    def _flush_repeated(self):
+        if self._repeated:
+            last = self._last
+            summary = logging.LogRecord(last.name, last.levelno, last.pathname, last.lineno,
+                                        "last message repeated %d times", (self._repeated,), None)
+            self._repeated = 0
+            self._dispatch(summary)
+
+    def emit(self, record):
+        if not self.aggregate:
+            self._dispatch(record)
+            return
+        last = self._last
+        if last is not None and record.msg == last.msg and record.args == last.args and \
+                record.levelno == last.levelno and record.name == last.name and not record.exc_info:
+            if not self._repeated:
+                self._first_repeat = record.created
+            self._repeated += 1
+            if record.created - self._first_repeat >= self.max_delay:
+                self._flush_repeated()
+            return
+        self._flush_repeated()
+        self._last = record
+        self._dispatch(record)
+
+    def flush_expired(self):
+        """
+        Write the pending repetition if it is older than max_delay seconds
+        """
+        if self._repeated and time.time() - self._first_repeat >= self.max_delay:
+            self._flush_repeated()
+
+    def flush(self):
+        self._flush_repeated()
+        for handler in self.handlers:
+            handler.flush()
+
+    def close(self):
+        self.flush()
+        logging.Handler.close(self)
+
+
+class _AggregatingListener(QueueListener):
+    """
+    QueueListener for an AggregatingHandler: it wakes up while the queue is empty to write the repetitions pending
+    for too long, and waits for room in a bounded queue to enqueue its stop sentinel
+    """
+
+    def __init__(self, q, aggregator):
+        QueueListener.__init__(self, q, aggregator)
+        self.aggregator = aggregator
+        self.poll_interval = max(0.05, aggregator.max_delay / 2.0)
+
+    def dequeue(self, block):
+        while True:
+            try:
+                return self.queue.get(block, self.poll_interval)
+            except queue.Empty:
+                self.aggregator.flush_expired()
+
+    def enqueue_sentinel(self):
+        # put_nowait() would raise queue.Full with a bounded queue still full: the listener is draining it
+        self.queue.put(self._sentinel)
+
+
+class QueuedLogging:
+    """
+    Move the handlers of a logger behind a queue served by a background thread
+
+    Class Attributes:
+        logger -- the logger whose handlers are moved (default: root logger)
+        handlers -- handlers doing the real I/O. If None the current handlers of "logger" are used; if it has none
+                    a stderr StreamHandler is created
+        rate -- if given, records per second allowed for every kind of message (see RateLimitFilter)
+        burst -- burst size for the rate limiter
+        aggregate -- if True consecutive identical messages are collapsed (default: True)
+        max_queue -- max records waiting to be written, 0 means unlimited. When full, new records are dropped
+                     instead of blocking the caller (default: 0)
+    """
+
+    def __init__(self, logger=None, handlers=None, rate=None, burst=None, aggregate=True, max_queue=0):
+        self.logger = logger if logger is not None else logging.getLogger()
+        self.handlers = handlers
+        self.rate = rate
+        self.burst = burst
+        self.aggregate = aggregate
+        self.max_queue = max_queue
+        self.queue_handler = None
+        self._listener = None
+        self._aggregator = None
+        self._saved_handlers = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def start(self):
+        if self._listener is not None:
+            return
+        self._saved_handlers = list(self.logger.handlers)
+        handlers = self.handlers if self.handlers is not None else self._saved_handlers
+        if not handlers:
+            handlers = [logging.StreamHandler()]
+
+        self._aggregator = AggregatingHandler(handlers, self.aggregate)
+        self.queue_handler = LazyQueueHandler(queue.Queue(self.max_queue))
+        if self.rate is not None:
+            self.queue_handler.addFilter(RateLimitFilter(self.rate, self.burst))
+        self._listener = _AggregatingListener(self.queue_handler.queue, self._aggregator)
+
+        for handler in self._saved_handlers:
+            self.logger.removeHandler(handler)
+        self.logger.addHandler(self.queue_handler)
+        self._listener.start()
+
+    def stop(self):
+        """
+        Write every queued record and give the logger its handlers back
+        """
+        if self._listener is None:
+            return
+        self.logger.removeHandler(self.queue_handler)
+        try:
+            self._listener.stop()
+            self._aggregator.flush()
+        finally:
+            for handler in self._saved_handlers:
+                self.logger.addHandler(handler)
+            self._listener = None
+
+
+_pipeline = None
+
+
+def start_queued_logging(logger=None, handlers=None, rate=None, burst=None, aggregate=True, max_queue=0):
+    """
+    Start the process wide queued logging pipeline (see QueuedLogging) and return it.
+    The pipeline is stopped, and every pending record written, at interpreter exit.
+    """
+    global _pipeline
+    if _pipeline is None:
+        _pipeline = QueuedLogging(logger, handlers, rate, burst, aggregate, max_queue)
+        _pipeline.start()
+    return _pipeline
+
+
+def stop_queued_logging():
+    """
+    Stop the pipeline started by start_queued_logging() writing every pending record
+    """
+    global _pipeline
+    if _pipeline is not None:
+        _pipeline.stop()
+        _pipeline = None
+
+
+atexit.register(stop_queued_logging)
+
+
+if __name__ == "__main__":
+    # Small benchmark: the same bulk logging with and without the pipeline on a slow (file) handler
+    import os
+    import tempfile
+
+    log_path = os.path.join(tempfile.mkdtemp(), "omnitools.log")
+    logging.basicConfig(filename=log_path, level=logging.DEBUG, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    def bulk():
+        start = time.time()
+        for i in range(20000):
+            logging.info("Directory %s existing, setting permissions", "/tmp/dir%d" % (i % 10))
+            logging.info("Permessions %s changed", 509)
+        return time.time() - start
+
+    print("synchronous logging: %.3f s" % bulk())
+    with QueuedLogging(rate=1000):
+        print("queued logging:      %.3f s (caller side)" % bulk())
+    print("log written in %s" % log_path)
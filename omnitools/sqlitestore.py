@@ -0,0 +1,354 @@
+#!/usr/bin/env python
+"""
+    File name: sqlitestore.py
+    Python Version: 2.7.X
+    Transactional SQLite persistence for Grid and LatencyList objects.
+    Unlike shelve, that pickles a whole object under one key, a Grid is stored split in cubic chunks of cells and
+    every LatencyList in its own row: saving rewrites only the chunks/series changed since the last save and any
+    region or series can be loaded alone. The database runs in WAL mode, so readers are never blocked by a writer.
+    A connection can't be shared between threads: open one SQLiteStore per thread or process.
+
+    Usage
+        store = SQLiteStore("state.db")
+        store.save_grid("world", g)                       # first save writes every chunk
+        g.place({(1, 2, 3): 'a'})
+        store.save_grid("world", g)                       # only the chunk containing (1, 2, 3) is rewritten
+        g.subscribe(lambda grid, changes: changed.update(changes))
+        store.save_grid("world", g, changed)              # only the chunks of the changed cells are looked at,
+                                                          # then "changed" is emptied
+        region = store.load_grid_region("world", (1, 1, 1), (16, 16, 16))
+        with store.transaction():                         # many saves, one commit
+            for name, latency_list in probes.items():
+                store.save_latencies(name, latency_list)
+"""
+import contextlib
+import hashlib
+import os
+import sqlite3
+import sys
+
+try:
+    import cPickle as pickle
+except ImportError:  # python 3: pickle is already the C implementation
+    import pickle
+
+from omnitools import LatencyList
+
+# grid.py lives in class_grid/, a sibling of this directory
+GRID_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "class_grid")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS grids (
+    name TEXT PRIMARY KEY,
+    size_x INTEGER, size_y INTEGER, size_z INTEGER,
+    chunk_size INTEGER,
+    position_overwriting INTEGER,
+    elements_table BLOB
+);
+CREATE TABLE IF NOT EXISTS grid_chunks (
+    grid TEXT,
+    cx INTEGER, cy INTEGER, cz INTEGER,
+    digest BLOB,
+    cells BLOB,
+    PRIMARY KEY (grid, cx, cy, cz)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS latency_series (
+    name TEXT PRIMARY KEY,
+    max_width INTEGER,
+    used_latencies INTEGER,
+    digest BLOB,
+    latencies BLOB
+);
+"""
+
+
+def _grid_class():
+    if GRID_DIR not in sys.path:
+        sys.path.insert(0, GRID_DIR)
+    from grid import Grid
+    return Grid
+
+
+def _dumps(obj):
+    blob = pickle.dumps(obj, 2)
+    return sqlite3.Binary(blob), hashlib.sha1(blob).digest()
+
+
+def _loads(blob):
+    return pickle.loads(bytes(blob))
+
+
+class SQLiteStore:
+    """
+    SQLite (WAL mode) store of Grid chunks and LatencyList windows
+
+    Class Attributes:
+        path -- database file path
+        chunk_size -- side of the cubic chunks new grids are split in (default: 16). A grid keeps the chunk size it
+                      was first saved with
+        connection -- the sqlite3 connection, in autocommit mode: transactions are handled by transaction()
+
+    DocTest
+    >>> store = SQLiteStore(":memory:", chunk_size=4)
+    >>> g = _grid_class()({(1, 1, 1): 'a', (5, 5, 5): 'b', (9, 1, 1): 'a'}, ['a', 'b'], grid_size=(10, 10, 10))
+    >>> store.save_grid("g", g)
+    3
+    >>> g.place({(2, 1, 1): 'b'})
+    True
+    >>> store.save_grid("g", g)
+    1
+    >>> sorted(store.load_grid("g").space.items())
+    [((1, 1, 1), 'a'), ((2, 1, 1), 'b'), ((5, 5, 5), 'b'), ((9, 1, 1), 'a')]
+    >>> sorted(store.load_grid_region("g", (1, 1, 1), (5, 5, 4)).items())
+    [((1, 1, 1), 'a'), ((2, 1, 1), 'b')]
+    >>> del g.space[(9, 1, 1)]
+    >>> store.save_grid("g", g)
+    1
+    >>> len(store.load_grid("g").space)
+    3
+    >>> changed = set()
+    >>> g.subscribe(lambda grid, changes: changed.update(changes))
+    >>> g.fill_box((9, 9, 9), (10, 10, 10), 'a'), g.place({(9, 1, 1): 'b'})
+    (8, True)
+    >>> store.save_grid("g", g, changed)
+    2
+    >>> len(store.load_grid("g").space), len(changed)
+    (12, 0)
+    >>> g.place({(1, 1, 1): 'b'})
+    True
+    >>> try:
+    ...     with store.transaction():
+    ...         store.save_grid("g", g, changed)
+    ...         raise RuntimeError("rolled back")
+    ... except RuntimeError:
+    ...     pass
+    1
+    >>> len(changed), store.save_grid("g", g, changed), len(changed), store.load_grid("g").space[(1, 1, 1)]
+    (1, 1, 0, 'b')
+    >>> store.save_latencies("probe1", LatencyList([10.5, None, 12.0], 2))
+    True
+    >>> store.save_latencies("probe1", LatencyList([10.5, None, 12.0], 2))
+    False
+    >>> store.load_latencies("probe1").get_used_latencies()
+    [None, 12.0]
+    """
+
+    def __init__(self, path, chunk_size=16, timeout=30.0):
+        self.path = path
+        self.chunk_size = int(chunk_size)
+        self.connection = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")  # with WAL: durable at checkpoints, never corrupted
+        self.connection.executescript(SCHEMA)
+        self._transaction_depth = 0
+        self._saved_changes = []  # (changed set, coordinates saved from it) to remove from it on COMMIT
+        # Digests of what is in the database: ("grid", name) -> {chunk key: digest}, ("series", name) -> digest
+        self._digests = {}
+
+    def close(self):
+        self.connection.close()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Group every write done inside the "with" block in a single transaction. Nested blocks join the outer one.
+        """
+        if self._transaction_depth == 0:
+            self.connection.execute("BEGIN IMMEDIATE")
+        self._transaction_depth += 1
+        try:
+            yield self
+        except BaseException:
+            self._transaction_depth -= 1
+            if self._transaction_depth == 0:
+                self._saved_changes = []  # not saved after all: the next save_grid() looks at them again
+                self.connection.execute("ROLLBACK")
+                self._digests.clear()  # the cache could describe rolled back writes
+            raise
+        else:
+            self._transaction_depth -= 1
+            if self._transaction_depth == 0:
+                self.connection.execute("COMMIT")
+                saved_changes = self._saved_changes
+                self._saved_changes = []
+                for changed, saved in saved_changes:
+                    changed.difference_update(saved)
+
+    # ==== Grid ====
+
+    def _grid_meta(self, name):
+        return self.connection.execute("SELECT size_x, size_y, size_z, chunk_size, position_overwriting, "
+                                       "elements_table FROM grids WHERE name = ?", (name,)).fetchone()
+
+    def _chunk_digests(self, name):
+        digests = self._digests.get(("grid", name))
+        if digests is None:
+            digests = dict(((cx, cy, cz), bytes(digest)) for cx, cy, cz, digest in self.connection.execute(
+                "SELECT cx, cy, cz, digest FROM grid_chunks WHERE grid = ?", (name,)))
+            self._digests[("grid", name)] = digests
+        return digests
+
+    @staticmethod
+    def split_in_chunks(space, chunk_size):
+        """
+        Return a dictionary {(cx, cy, cz): {coordinates: element}} grouping the cells of "space" by chunk.
+        Chunk (0, 0, 0) holds the coordinates from (1, 1, 1) to (chunk_size, chunk_size, chunk_size).
+        """
+        chunks = {}
+        for coordinates, element in space.items():
+            key = ((coordinates[0] - 1) // chunk_size, (coordinates[1] - 1) // chunk_size,
+                   (coordinates[2] - 1) // chunk_size)
+            cells = chunks.get(key)
+            if cells is None:
+                cells = chunks[key] = {}
+            cells[coordinates] = element
+        return chunks
+
+    def save_grid(self, name, grid, changed=None):
+        """
+        Save "grid" under "name" writing only the chunks changed since the last save.
+        Return the number of chunks written or deleted.
+            changed -- set of the coordinates changed since the last save, for example gathered with
+                       Grid.subscribe(): only their chunks are looked at instead of the whole grid. The coordinates
+                       saved are removed from it once committed: at the end of the outermost transaction() when the
+                       call is inside one, never if that one is rolled back (default: None)
+        """
+        meta = self._grid_meta(name)
+        chunk_size = meta[3] if meta is not None else self.chunk_size
+        digests = self._chunk_digests(name)
+        if changed is None or meta is None:
+            chunks = self.split_in_chunks(grid.space, chunk_size)
+            deleted = [key for key in digests if key not in chunks]
+        else:
+            chunks = {}
+            deleted = []
+            for key in set(((x - 1) // chunk_size, (y - 1) // chunk_size, (z - 1) // chunk_size)
+                           for x, y, z in changed):
+                lower = [axis_key * chunk_size + 1 for axis_key in key]
+                cells = grid[lower[0]:lower[0] + chunk_size, lower[1]:lower[1] + chunk_size,
+                             lower[2]:lower[2] + chunk_size]
+                if cells:
+                    chunks[key] = cells
+                elif key in digests:
+                    deleted.append(key)
+        written = {}  # chunk key -> (digest, blob)
+        for key, cells in chunks.items():
+            blob, digest = _dumps(sorted(cells.items()))  # coordinates are unique: elements are never compared
+            if digests.get(key) != digest:
+                written[key] = (digest, blob)
+
+        with self.transaction():
+            self.connection.execute("INSERT OR REPLACE INTO grids VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                    (name, grid.grid_size[0], grid.grid_size[1], grid.grid_size[2], chunk_size,
+                                     int(grid.position_overwriting), _dumps(grid.elements_table)[0]))
+            self.connection.executemany("INSERT OR REPLACE INTO grid_chunks VALUES (?, ?, ?, ?, ?, ?)",
+                                        [(name,) + key + (sqlite3.Binary(digest), blob)
+                                         for key, (digest, blob) in written.items()])
+            self.connection.executemany("DELETE FROM grid_chunks WHERE grid = ? AND cx = ? AND cy = ? AND cz = ?",
+                                        [(name,) + key for key in deleted])
+        for key, (digest, blob) in written.items():
+            digests[key] = digest
+        for key in deleted:
+            del digests[key]
+        if changed is not None:
+            if self._transaction_depth:
+                self._saved_changes.append((changed, frozenset(changed)))
+            else:
+                changed.clear()
+        return len(written) + len(deleted)
+
+    def _load_chunks(self, name, where="", parameters=()):
+        space = {}
+        for (blob,) in self.connection.execute("SELECT cells FROM grid_chunks WHERE grid = ?" + where,
+                                               (name,) + tuple(parameters)):
+            space.update(_loads(blob))
+        return space
+
+    def load_grid(self, name):
+        """
+        Return the Grid saved under "name". KeyError is raised if there is no such grid.
+        """
+        meta = self._grid_meta(name)
+        if meta is None:
+            raise KeyError(name)
+        g = _grid_class()(None, _loads(meta[5]), (meta[0], meta[1], meta[2]), bool(meta[4]))
+        g.space.update(self._load_chunks(name))  # cells were validated when placed in the saved grid
+        return g
+
+    def load_grid_region(self, name, lower, upper):
+        """
+        Return a dictionary {coordinates: element} with the cells of grid "name" inside the box going from "lower"
+        to "upper" coordinates (both included). Only the chunks crossing the box are read.
+        """
+        meta = self._grid_meta(name)
+        if meta is None:
+            raise KeyError(name)
+        chunk_size = meta[3]
+        bounds = []
+        for axis in range(3):
+            bounds.extend(((lower[axis] - 1) // chunk_size, (upper[axis] - 1) // chunk_size))
+        space = self._load_chunks(name, " AND cx BETWEEN ? AND ? AND cy BETWEEN ? AND ? AND cz BETWEEN ? AND ?",
+                                  bounds)
+        return dict((coordinates, element) for coordinates, element in space.items()
+                    if lower[0] <= coordinates[0] <= upper[0] and lower[1] <= coordinates[1] <= upper[1] and
+                    lower[2] <= coordinates[2] <= upper[2])
+
+    def grid_names(self):
+        return [name for (name,) in self.connection.execute("SELECT name FROM grids ORDER BY name")]
+
+    def delete_grid(self, name):
+        with self.transaction():
+            self.connection.execute("DELETE FROM grid_chunks WHERE grid = ?", (name,))
+            self.connection.execute("DELETE FROM grids WHERE name = ?", (name,))
+        self._digests.pop(("grid", name), None)
+
+    # ==== LatencyList ====
+
+    def _series_digest(self, name):
+        key = ("series", name)
+        if key not in self._digests:
+            row = self.connection.execute("SELECT digest FROM latency_series WHERE name = ?", (name,)).fetchone()
+            self._digests[key] = bytes(row[0]) if row is not None else None
+        return self._digests[key]
+
+    def save_latencies(self, name, latency_list):
+        """
+        Save the window of "latency_list" under "name" if it changed since the last save.
+        Return True if the series was written.
+        """
+        blob, digest = _dumps((latency_list.max_width, latency_list.used_latencies, latency_list.latencies))
+        if self._series_digest(name) == digest:
+            return False
+        with self.transaction():
+            self.connection.execute("INSERT OR REPLACE INTO latency_series VALUES (?, ?, ?, ?, ?)",
+                                    (name, latency_list.max_width, latency_list.used_latencies,
+                                     sqlite3.Binary(digest), blob))
+        self._digests[("series", name)] = digest
+        return True
+
+    def save_latency_lists(self, latency_lists):
+        """
+        Save a dictionary {name: LatencyList} in a single transaction. Return the number of series written.
+        """
+        with self.transaction():
+            return sum(1 for name, latency_list in latency_lists.items() if self.save_latencies(name, latency_list))
+
+    def load_latencies(self, name):
+        """
+        Return the LatencyList saved under "name". KeyError is raised if there is no such series.
+        """
+        row = self.connection.execute("SELECT latencies FROM latency_series WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            raise KeyError(name)
+        max_width, used_latencies, latencies = _loads(row[0])
+        latency_list = LatencyList(latencies, used_latencies)
+        latency_list.max_width = max_width
+        return latency_list
+
+    def latency_names(self):
+        return [name for (name,) in self.connection.execute("SELECT name FROM latency_series ORDER BY name")]
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+"""
+    File name: startup_benchmark.py
+    Python Version: 2.7.X
+    Check the import time budget of omnitools and of its command line entry point.
+    Every measure is the best of N fresh interpreters, minus the best time of an interpreter doing nothing, so what is
+    left is only the cost of our code and of what it imports.
+    Exit status is 1 if a budget is exceeded or if a lazily imported module got loaded at import time.
+
+    Usage
+        python startup_benchmark.py
+        python startup_benchmark.py --runs 50 --import-budget 5 --cli-budget 40
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Modules omnitools must not load just because somebody imported it
+LAZY_MODULES = ("math", "platform", "logging", "pwd")
+
+
+def best_run_time(code, runs):
+    """
+    Return the best wall clock time (in ms) of "runs" fresh interpreters executing "code"
+    """
+    best = None
+    devnull = open(os.devnull, "w")
+    for _ in range(runs):
+        start = time.time()
+        subprocess.check_call([sys.executable, "-c", code], cwd=HERE, stdout=devnull)
+        elapsed = (time.time() - start) * 1000.0
+        if best is None or elapsed < best:
+            best = elapsed
+    devnull.close()
+    return best
+
+
+def loaded_lazy_modules():
+    """
+    Return the LAZY_MODULES that a fresh interpreter has in sys.modules after importing omnitools
+    """
+    code = "import sys\n" \
+           "before = set(sys.modules)\n" \
+           "import omnitools\n" \
+           "print(' '.join(m for m in %r if m in sys.modules and m not in before))" % (LAZY_MODULES,)
+    output = subprocess.check_output([sys.executable, "-c", code], cwd=HERE)
+    return output.decode().split()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="omnitools startup time budget check")
+    parser.add_argument("--runs", type=int, default=20, help="interpreters started for every measure (default: 20)")
+    parser.add_argument("--import-budget", type=float, default=10.0,
+                        help="max ms spent importing omnitools (default: 10)")
+    parser.add_argument("--cli-budget", type=float, default=50.0,
+                        help="max ms spent running 'cli.py bytes2human' (default: 50)")
+    args = parser.parse_args(argv)
+
+    failures = []
+
+    eager = loaded_lazy_modules()
+    if eager:
+        failures.append("modules loaded at import time: %s" % ", ".join(eager))
+
+    baseline = best_run_time("pass", args.runs)
+    import_time = best_run_time("import omnitools", args.runs) - baseline
+    cli_time = best_run_time("import sys, cli; sys.argv = ['omnitools', 'bytes2human', '1024']; cli.main()",
+                             args.runs) - baseline
+
+    print("interpreter startup: %.2f ms" % baseline)
+    print("import omnitools:    %.2f ms (budget %.2f ms)" % (import_time, args.import_budget))
+    print("cli bytes2human:     %.2f ms (budget %.2f ms)" % (cli_time, args.cli_budget))
+
+    if import_time > args.import_budget:
+        failures.append("import omnitools took %.2f ms" % import_time)
+    if cli_time > args.cli_budget:
+        failures.append("cli bytes2human took %.2f ms" % cli_time)
+
+    for failure in failures:
+        print("FAILED: %s" % failure)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())